@@ -0,0 +1 @@
+# benchmarks of the processing pipeline on synthetic data
@@ -0,0 +1,239 @@
+"""
+Benchmark of the download -> load -> process -> write pipeline on
+synthetic data, offline: archives are served by a local http server.
+the source goes through the methods of Trip.run_url, every stage is
+timed by the metrics of the trip, with --memory an extra run traces
+the memory peak of each stage (tracing slows it down, so it is not timed).
+usage:
+    python -m benchmarks.run --rows 200000 --output bench.json
+    python -m benchmarks.run --rows 200000 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import importlib
+from contextlib import contextmanager
+from functools import partial
+from http.server import ThreadingHTTPServer
+from http.server import SimpleHTTPRequestHandler
+
+import holidays as hld
+import pandas as pd
+
+from biketrips.bikesystem import SYS_LIST
+from biketrips.bikesystem import selector
+from biketrips.dates import DateDimension
+from biketrips.metrics import Metrics
+from benchmarks.synthetic import START
+from benchmarks.synthetic import make_archive
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['download', 'load', 'station_trip_join', 'break_datetime', 'holidays', 'write', 'aggregate']
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Server:
+    """
+    http server of a directory in a background thread.
+    """
+    def __init__(self, directory):
+        handler = partial(QuietHandler, directory=directory)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TracedMetrics(Metrics):
+    """
+    metrics of a trip, also tracing the memory peak of each stage.
+    """
+    def __init__(self, bike_sys, memory=False):
+        super().__init__(None, bike_sys)
+        self.memory = memory
+        self.peaks = dict.fromkeys(STAGES, 0)
+
+    @contextmanager
+    def stage(self, name, **fields):
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        with super().stage(name, **fields) as record:
+            yield record
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1] - base
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    def seconds(self, stage):
+        return self.totals.get(stage, {}).get('seconds', 0.0)
+
+
+def run_pipeline(operator, url, args, memory=False):
+    """
+    run Trip.run_url on the source at url, chunk by chunk, through its
+    methods: download, open_chunks, transform and write.
+    return the number of processed rows and the metrics of the trip.
+    """
+    trip = selector(dict(args, bike_sys=operator))
+    trip.metrics = TracedMetrics(operator, memory)
+    module = importlib.import_module(f'biketrips.operators.{operator}')
+    holidays = hld.country_holidays(module.COUNTRY, subdiv=module.PROV or module.STATE)
+    # the date dimension is built upfront, as in run_urls
+    trip.dates = DateDimension(holidays, [pd.Timestamp(START).year])
+
+    save_dir, files = trip.download(url)
+    chunks, kwargs = trip.open_chunks(url, save_dir, files, trip.rename_dict, holidays, trip.chunksize)
+    rows = 0
+    for save_name, trip_df in chunks:
+        trip_df = trip.transform(trip_df=trip_df, save_name=save_name, **kwargs)
+        trip.write(trip_df, save_dir, save_name)
+        rows += len(trip_df)
+    return rows, trip.metrics
+
+def bench_operator(operator, server, args, repeat, memory):
+    """
+    best time of repeat runs of each stage and their memory peaks.
+    """
+    url = f'{server.url}/{os.path.basename(server.archives[operator])}'
+    runs = []
+    for traced in [False] * repeat + [True] * memory:
+        data_dir = tempfile.mkdtemp(prefix=f'bench_{operator}_')
+        if traced:
+            tracemalloc.start()
+        try:
+            rows, metrics = run_pipeline(operator, url, dict(args, data_dir=data_dir), traced)
+        finally:
+            if traced:
+                tracemalloc.stop()
+            shutil.rmtree(data_dir)
+        runs.append(metrics)
+    res = {}
+    for stage in STAGES:
+        seconds = min(metrics.seconds(stage) for metrics in runs[:repeat])
+        res[stage] = {
+            'seconds': round(seconds, 4),
+            'rows': rows,
+            'rows_per_s': round(rows / seconds) if seconds > 0 else None,
+            }
+        if memory:
+            res[stage]['peak_mb'] = round(runs[-1].peaks[stage] / 1024 ** 2, 1)
+    total = sum(res[stage]['seconds'] for stage in STAGES)
+    res['total'] = {'seconds': round(total, 4), 'rows': rows, 'rows_per_s': round(rows / total)}
+    return res
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """
+    print the seconds of each stage against baseline.
+    """
+    print(f'{"operator":<10}{"stage":<20}{"baseline":>10}{"current":>10}{"ratio":>8}')
+    for operator, stages in results['results'].items():
+        for stage, values in stages.items():
+            old = baseline['results'].get(operator, {}).get(stage)
+            if old is None or not old['seconds']:
+                continue
+            ratio = values['seconds'] / old['seconds']
+            print(f'{operator:<10}{stage:<20}{old["seconds"]:>10.3f}{values["seconds"]:>10.3f}{ratio:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bike-trips benchmarks')
+    parser.add_argument('--operators', type=str, default=','.join(SYS_LIST), help='comma separated bike system tags')
+    parser.add_argument('--rows', type=int, default=100000, help='trips per operator')
+    parser.add_argument('--chunk-size', type=int, default=None, help='chunk_size of the pipeline')
+    parser.add_argument('--output-format', type=str, default='csv', help='csv or parquet')
+    parser.add_argument('--columns', type=str, default=None, help='comma separated columns option of the pipeline')
+    parser.add_argument('--aggregates', action='store_true', help='aggregates option of the pipeline')
+    parser.add_argument('--star-schema', action='store_true', help='star_schema option of the pipeline')
+    parser.add_argument('--parse-engine', type=str, default='pandas', help='pandas or pyarrow')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per operator, the best time is kept')
+    parser.add_argument('--memory', action='store_true', help='trace the memory peak of each stage in an extra run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='json file of the results')
+    parser.add_argument('--compare', type=str, default=None, help='json file of previous results')
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    operators = opts.operators.split(',')
+    args = {'output_format': opts.output_format}
+    if opts.chunk_size:
+        args['chunk_size'] = opts.chunk_size
+    if opts.columns:
+        args['columns'] = opts.columns.split(',')
+    args['parse_engine'] = opts.parse_engine
+    args['aggregates'] = opts.aggregates
+    args['star_schema'] = opts.star_schema
+
+    data_dir = tempfile.mkdtemp(prefix='bench_data_')
+    try:
+        archives = {
+            operator: make_archive(operator, opts.rows, data_dir, opts.seed)
+            for operator in operators}
+        results = {}
+        with Server(data_dir) as server:
+            server.archives = archives
+            for operator in operators:
+                results[operator] = bench_operator(operator, server, args, opts.repeat, opts.memory)
+                print(f'{operator}: {results[operator]["total"]}', file=sys.stderr)
+    finally:
+        shutil.rmtree(data_dir)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'rows': opts.rows,
+            'chunk_size': opts.chunk_size,
+            'output_format': opts.output_format,
+            'columns': opts.columns,
+            'parse_engine': opts.parse_engine,
+            'aggregates': opts.aggregates,
+            'star_schema': opts.star_schema,
+            'repeat': opts.repeat,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            },
+        'results': results,
+        }
+    if opts.output:
+        with open(opts.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if opts.compare:
+        with open(opts.compare, 'r') as file:
+            compare(results, json.load(file))
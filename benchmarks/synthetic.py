@@ -0,0 +1,148 @@
+"""
+Synthetic trip and station files in the raw layout of each operator.
+usage: python -m benchmarks.synthetic --operator citi --rows 100000 --out ./bench_data
+"""
+import os
+import argparse
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import numpy as np
+import pandas as pd
+
+N_STATIONS = 600
+START = '2021-07-01'
+DAYS = 31
+
+
+def stations(rng, first_code):
+    """
+    station codes, names and coordinates.
+    """
+    return pd.DataFrame({
+        'code': np.arange(first_code, first_code + N_STATIONS),
+        'name': [f'Station {i} / Street {i % 97}' for i in range(N_STATIONS)],
+        'latitude': 45.4 + rng.random(N_STATIONS) / 10,
+        'longitude': -73.6 + rng.random(N_STATIONS) / 10,
+        })
+
+def trips(rng, n_rows, station_df):
+    """
+    random trips between stations, started during DAYS days.
+    """
+    start = pd.Timestamp(START) + pd.to_timedelta(rng.integers(0, DAYS * 86400, n_rows), unit='s')
+    duration = rng.gamma(2.0, 500.0, n_rows).astype(np.int64) + 60
+    start_pos = rng.integers(0, len(station_df), n_rows)
+    end_pos = rng.integers(0, len(station_df), n_rows)
+    return {
+        'start': start,
+        'end': start + pd.to_timedelta(duration, unit='s'),
+        'duration': duration,
+        'start_station': station_df.iloc[start_pos].reset_index(drop=True),
+        'end_station': station_df.iloc[end_pos].reset_index(drop=True),
+        'member': rng.integers(0, 2, n_rows),
+        }
+
+def bixi_files(rng, n_rows):
+    station_df = stations(rng, 6000)
+    data = trips(rng, n_rows, station_df)
+    trip_df = pd.DataFrame({
+        'start_date': data['start'].strftime('%Y-%m-%d %H:%M'),
+        'start_station_code': data['start_station']['code'],
+        'end_date': data['end'].strftime('%Y-%m-%d %H:%M'),
+        'end_station_code': data['end_station']['code'],
+        'duration_sec': data['duration'],
+        'is_member': data['member'],
+        })
+    return {'Stations_2021.csv': station_df, 'OD_2021-07.csv': trip_df}
+
+def bsto_files(rng, n_rows):
+    station_df = stations(rng, 7000)
+    data = trips(rng, n_rows, station_df)
+    trip_df = pd.DataFrame({
+        'trip_id': np.arange(n_rows) + 1000000,
+        'trip_start_time': data['start'].strftime('%m/%d/%Y %H:%M'),
+        'trip_stop_time': data['end'].strftime('%m/%d/%Y %H:%M'),
+        'trip_duration_seconds': data['duration'],
+        'from_station_id': data['start_station']['code'],
+        'from_station_name': data['start_station']['name'],
+        'to_station_id': data['end_station']['code'],
+        'to_station_name': data['end_station']['name'],
+        'user_type': np.where(data['member'] == 1, 'Annual Member', 'Casual Member'),
+        })
+    return {'Bikeshare Ridership (2021 Q3).csv': trip_df}
+
+def cabi_files(rng, n_rows):
+    station_df = stations(rng, 31000)
+    data = trips(rng, n_rows, station_df)
+    trip_df = pd.DataFrame({
+        'Duration': data['duration'],
+        'Start date': data['start'].strftime('%Y-%m-%d %H:%M:%S'),
+        'End date': data['end'].strftime('%Y-%m-%d %H:%M:%S'),
+        'Start station number': data['start_station']['code'],
+        'Start station': data['start_station']['name'],
+        'End station number': data['end_station']['code'],
+        'End station': data['end_station']['name'],
+        'Bike number': [f'W{i:05d}' for i in rng.integers(0, 5000, n_rows)],
+        'Member type': np.where(data['member'] == 1, 'Member', 'Casual'),
+        })
+    return {'202107-capitalbikeshare-tripdata.csv': trip_df}
+
+def citi_files(rng, n_rows):
+    station_df = stations(rng, 3000)
+    data = trips(rng, n_rows, station_df)
+    trip_df = pd.DataFrame({
+        'tripduration': data['duration'],
+        'starttime': data['start'].strftime('%Y-%m-%d %H:%M:%S.%f').str[:-2],
+        'stoptime': data['end'].strftime('%Y-%m-%d %H:%M:%S.%f').str[:-2],
+        'start station id': data['start_station']['code'],
+        'start station name': data['start_station']['name'],
+        'start station latitude': data['start_station']['latitude'],
+        'start station longitude': data['start_station']['longitude'],
+        'end station id': data['end_station']['code'],
+        'end station name': data['end_station']['name'],
+        'end station latitude': data['end_station']['latitude'],
+        'end station longitude': data['end_station']['longitude'],
+        'bikeid': rng.integers(14000, 50000, n_rows),
+        'usertype': np.where(data['member'] == 1, 'Subscriber', 'Customer'),
+        'birth year': rng.integers(1950, 2005, n_rows),
+        'gender': rng.integers(0, 3, n_rows),
+        })
+    return {'202107-citibike-tripdata.csv': trip_df}
+
+GENERATORS = {
+    'bixi': bixi_files,
+    'bsto': bsto_files,
+    'cabi': cabi_files,
+    'citi': citi_files,
+    }
+
+ARCHIVE_NAMES = {
+    'bixi': 'biximontreal-rentals-2021-07.zip',
+    'bsto': 'bikeshare-ridership-2021.zip',
+    'cabi': '202107-capitalbikeshare-tripdata.zip',
+    'citi': '202107-citibike-tripdata.zip',
+    }
+
+
+def make_archive(operator, n_rows, out_dir, seed=0):
+    """
+    write a zip archive of synthetic files of operator in out_dir.
+    return the archive path.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, ARCHIVE_NAMES[operator])
+    with ZipFile(path, 'w', ZIP_DEFLATED) as zip_file:
+        for name, df in GENERATORS[operator](rng, n_rows).items():
+            zip_file.writestr(name, df.to_csv(index=False))
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='synthetic bike-trips data')
+    parser.add_argument('--operator', type=str, default='bixi', help='bike system tag')
+    parser.add_argument('--rows', type=int, default=100000, help='number of trips')
+    parser.add_argument('--out', type=str, default='./bench_data', help='output directory')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(make_archive(args.operator, args.rows, args.out, args.seed))
@@ -1 +1,3 @@
 #
+from biketrips.reader import scan
+from biketrips.star import denormalize
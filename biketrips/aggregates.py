@@ -0,0 +1,196 @@
+"""
+Station aggregates folded chunk by chunk and merged across sources and runs.
+usage: python -m biketrips.aggregates --data-dir ./data/bixi [--force]
+"""
+import os
+import json
+import logging
+import argparse
+
+from biketrips.compact import signature
+from biketrips.lazy import lazy_import
+from biketrips.manifest import Manifest
+from biketrips.utils import LOG_FMT
+from biketrips.utils import LOG_DATEFMT
+from biketrips.writer import station_codes
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_DIR = '_aggregates'
+AGGREGATES_DIR = 'aggregates'
+INDEX_FILE = '_index.json'
+# keys and summed values of every table
+TABLES = {
+    'station_hourly': (['station_code', 'date', 'hour'], ['departures', 'arrivals']),
+    'od_daily': (['date', 'start_station_code', 'end_station_code'], ['trips', 'duration_sec']),
+    }
+CODE_COLUMNS = ['station_code', 'start_station_code', 'end_station_code']
+# trip duration in seconds by operator: bixi, citi, cabi, bsto
+DURATION_COLUMNS = ['duration_sec', 'tripduration', 'trip_duration', 'duration', 'trip_duration_seconds', 'trip__duration']
+# trip columns the tables are computed from
+REQUIRED_COLUMNS = [
+    'start_station_code',
+    'end_station_code',
+    'start_dt',
+    'end_dt',
+    'start_hour',
+    'end_hour',
+    ] + DURATION_COLUMNS
+
+
+def format_keys(table):
+    """
+    index levels of a grouped table as stored: codes as strings, dates
+    as YYYY-MM-DD, hours as integers. levels hold unique values only.
+    """
+    levels = []
+    for name, level in zip(table.index.names, table.index.levels):
+        if name in CODE_COLUMNS:
+            level = station_codes(level)
+        elif name == 'date':
+            level = pd.to_datetime(level).strftime('%Y-%m-%d')
+        else:
+            level = level.astype('int64')
+        levels.append(level)
+    table.index = table.index.set_levels(levels, verify_integrity=False)
+    return table
+
+def count(trip_df, columns, names):
+    """
+    trips by the values of columns, renamed to names.
+    rows with a missing value are not counted.
+    """
+    table = trip_df.groupby(columns, sort=False, observed=True).size()
+    table.index = table.index.set_names(names)
+    return format_keys(table)
+
+def station_hourly(trip_df):
+    """
+    departures and arrivals of every station by day and hour.
+    """
+    keys = TABLES['station_hourly'][0]
+    departures = count(trip_df, ['start_station_code', 'start_dt', 'start_hour'], keys)
+    arrivals = count(trip_df, ['end_station_code', 'end_dt', 'end_hour'], keys)
+    table = pd.concat({'departures': departures, 'arrivals': arrivals}, axis=1)
+    return table.fillna(0).astype('int64').reset_index()
+
+def od_daily(trip_df):
+    """
+    trips and total duration between every pair of stations by day.
+    the duration is summed from the duration column of the operator,
+    files without one (citi and cabi since 2020) only count trips.
+    """
+    grouped = trip_df.groupby(['start_dt', 'start_station_code', 'end_station_code'], sort=False, observed=True)
+    table = grouped.size().to_frame('trips')
+    duration = next((column for column in DURATION_COLUMNS if column in trip_df), None)
+    if duration is not None:
+        table['duration_sec'] = grouped[duration].sum(min_count=1)
+    table.index = table.index.set_names(TABLES['od_daily'][0])
+    return format_keys(table).reset_index()
+
+def chunk_aggregates(trip_df):
+    """
+    tables of a processed chunk.
+    """
+    return {'station_hourly': station_hourly(trip_df), 'od_daily': od_daily(trip_df)}
+
+def write_partials(trip_df, save_dir, save_name):
+    """
+    write the tables of a chunk in save_dir/_aggregates,
+    return the written files and their table.
+    """
+    out_dir = os.path.join(save_dir, PARTIAL_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    stem = save_name.split('.')[0]
+    paths = {}
+    for name, table in chunk_aggregates(trip_df).items():
+        path = os.path.join(out_dir, f'{stem}_{name}.csv')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        paths[path] = {'aggregate': name}
+    return paths
+
+def read_table(path):
+    return pd.read_csv(path, dtype={column: str for column in CODE_COLUMNS})
+
+def combine(name, tables):
+    """
+    sum tables of name by their keys.
+    """
+    keys, values = TABLES[name]
+    table = pd.concat(tables, ignore_index=True)
+    values = [value for value in values if value in table]
+    return table.groupby(keys, sort=True)[values].sum(min_count=1).reset_index()
+
+def partials(data_dir):
+    """
+    partial tables of the sources marked complete in the manifest,
+    by table name, relative to data_dir.
+    """
+    tables = {name: [] for name in TABLES}
+    for entry in Manifest(data_dir).entries():
+        if entry['status'] != 'complete':
+            continue
+        for paths in entry.get('aggregates', {}).values():
+            for path in paths:
+                name = os.path.basename(path).split('.')[0]
+                name = next(table for table in TABLES if name.endswith(f'_{table}'))
+                if os.path.exists(os.path.join(data_dir, path)):
+                    tables[name].append(path)
+    return tables
+
+def merge(data_dir, force=False):
+    """
+    merge the partial tables of the complete sources of data_dir into
+    data_dir/aggregates/{table}.csv. new partials are added to the
+    current tables, which are rebuilt from the partials only if one of
+    those already merged changed or is gone, or if force.
+    aggregates/_index.json records the merged partials.
+    """
+    out_dir = os.path.join(data_dir, AGGREGATES_DIR)
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    index = {name: {} for name in TABLES}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            index.update(json.load(file))
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name, paths in partials(data_dir).items():
+        merged = index[name]
+        current = {path: signature(os.path.join(data_dir, path)) for path in paths}
+        out_path = os.path.join(out_dir, f'{name}.csv')
+        rebuild = force or not os.path.exists(out_path) or any(
+            current.get(path) != sig for path, sig in merged.items())
+        new = paths if rebuild else [path for path in paths if path not in merged]
+        if not new and not rebuild:
+            continue
+        tables = [read_table(os.path.join(data_dir, path)) for path in new]
+        if not rebuild:
+            tables.append(read_table(out_path))
+        if tables:
+            table = combine(name, tables)
+        else:
+            table = pd.DataFrame(columns=TABLES[name][0] + TABLES[name][1])
+        tmp_path = f'{out_path}.{os.getpid()}.tmp'
+        table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, out_path)
+        index[name] = current
+        logger.info(f'{name}: {len(new)} partial(s) merged, {len(table)} rows')
+
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=LOG_FMT, datefmt=LOG_DATEFMT)
+    parser = argparse.ArgumentParser(description='merge bike-trips station aggregates')
+    parser.add_argument('--data-dir', type=str, help='data directory of a bike system')
+    parser.add_argument('--force', action='store_true', help='rebuild every table from the partials')
+    parsed_args = parser.parse_args()
+    merge(parsed_args.data_dir, parsed_args.force)
@@ -0,0 +1,199 @@
+"""
+Multithreaded csv parsing with pyarrow, a drop-in for the pandas
+read_csv of the operators load.
+Class: ArrowCsvReader
+"""
+import logging
+import importlib.util
+
+from biketrips.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ['pandas', 'pyarrow']
+# bytes of csv per parsed block, blocks are parsed on several threads
+BLOCK_SIZE = 1 << 22
+# arrow types of the read_csv dtypes of the schema registry
+ARROW_TYPES = {
+    'Int8': 'int8',
+    'Int16': 'int16',
+    'Int32': 'int32',
+    'Int64': 'int64',
+    'float64': 'float64',
+    'category': 'dictionary',
+    }
+# read_csv options the reader understands, others are read by pandas
+OPTIONS = ['chunksize', 'dtype', 'usecols', 'na_values']
+
+
+def has_pyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+def parse_engine(engine):
+    """
+    csv parse engine to use for engine, pandas if pyarrow is missing.
+    """
+    if engine not in ENGINES:
+        raise Exception(f'Wrong value for parse_engine. {engine} not in {ENGINES}')
+    if engine == 'pyarrow' and not has_pyarrow():
+        logger.warning('parse_engine pyarrow requires pyarrow, csv files are parsed by pandas')
+        return 'pandas'
+    return engine
+
+
+class ArrowCsvReader:
+    """
+    csv file parsed by the pyarrow streaming reader, iterated as pandas
+    dataframes of chunksize rows like a pandas TextFileReader: the arrow
+    batches of every block are re-cut to the requested number of rows.
+    columns get the types of dtype, strings and dates are left as
+    strings, and categories are the sorted values of the chunk, as
+    pandas would read them.
+    """
+    def __init__(self, file, chunksize=None, dtype=None, usecols=None, na_values=None):
+        import pyarrow.csv as pc
+
+        self.file = file
+        self.chunksize = chunksize
+        self.dtype = dict(dtype or {})
+        self.usecols = list(usecols or [])
+        self.null_values = pc.ConvertOptions().null_values + list(na_values or [])
+        self.rows = 0
+        self.batches = []
+        self.buffered = 0
+        self.done = False
+        self.stream = None
+        self.reader = self.open(self.column_types())
+        # types are inferred from the first block, those pandas would
+        # not give are read as strings
+        strings = [
+            field.name for field in self.reader.schema
+            if field.name not in self.column_types() and not self.inferred(field.type)]
+        if strings:
+            self.close()
+            self.reader = self.open({**self.column_types(), **{name: 'string' for name in strings}})
+
+    @staticmethod
+    def inferred(arrow_type):
+        import pyarrow as pa
+
+        return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or \
+            pa.types.is_boolean(arrow_type) or pa.types.is_string(arrow_type)
+
+    def column_types(self):
+        return {
+            column: ARROW_TYPES[str(name)] for column, name in self.dtype.items()
+            if str(name) in ARROW_TYPES}
+
+    def open(self, column_types):
+        import pyarrow as pa
+        import pyarrow.csv as pc
+
+        types = {}
+        for column, name in column_types.items():
+            types[column] = pa.dictionary(pa.int32(), pa.string()) if name == 'dictionary' else getattr(pa, name)()
+        self.stream = self.file.open() if hasattr(self.file, 'zip_path') else self.file
+        return pc.open_csv(
+            self.stream,
+            read_options=pc.ReadOptions(block_size=BLOCK_SIZE, use_threads=True),
+            convert_options=pc.ConvertOptions(
+                column_types=types,
+                include_columns=self.usecols,
+                null_values=self.null_values,
+                strings_can_be_null=True))
+
+    def to_frame(self, table):
+        """
+        pandas dataframe of an arrow table, indexed after the rows
+        already read.
+        """
+        import pyarrow as pa
+
+        nullable = {
+            pa.int8(): pd.Int8Dtype(),
+            pa.int16(): pd.Int16Dtype(),
+            pa.int32(): pd.Int32Dtype()}
+        if 'Int64' in self.dtype.values():
+            nullable[pa.int64()] = pd.Int64Dtype()
+        chunk = table.to_pandas(types_mapper=nullable.get)
+        for column, name in self.dtype.items():
+            if column not in chunk:
+                continue
+            if str(name) == 'category':
+                # dictionaries hold the values of whole blocks
+                values = chunk[column].cat.remove_unused_categories()
+                chunk[column] = values.cat.reorder_categories(sorted(values.cat.categories))
+            elif str(name) not in ARROW_TYPES:
+                chunk[column] = chunk[column].astype(name)
+        chunk.index = pd.RangeIndex(self.rows, self.rows + len(chunk))
+        self.rows += len(chunk)
+        return chunk
+
+    def read_batch(self):
+        import pyarrow as pa
+
+        try:
+            batch = self.reader.read_next_batch()
+        except StopIteration:
+            self.done = True
+            return
+        except pa.ArrowInvalid as err:
+            raise Exception(f'{self.file}: {err}, parse it with parse_engine pandas')
+        self.batches.append(batch)
+        self.buffered += batch.num_rows
+
+    def take(self, size):
+        """
+        dataframe of the next size rows, all the rows left if size is None.
+        """
+        import pyarrow as pa
+
+        while not self.done and (size is None or self.buffered < size):
+            self.read_batch()
+        if not self.buffered:
+            raise StopIteration
+        table = pa.Table.from_batches(self.batches, self.reader.schema)
+        if size is not None and size < self.buffered:
+            table, rest = table.slice(0, size), table.slice(size)
+        else:
+            rest = table.slice(self.buffered)
+        self.batches = rest.to_batches()
+        self.buffered = rest.num_rows
+        return self.to_frame(table)
+
+    def get_chunk(self, size=None):
+        return self.take(size or self.chunksize)
+
+    def read(self):
+        return self.take(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get_chunk()
+
+    def close(self):
+        self.reader.close()
+        if self.stream is not self.file:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_csv(file, chunksize=None, **kwargs):
+    """
+    read_csv of a csv file with the pyarrow engine: a reader of chunks
+    of chunksize rows, or the whole dataframe without chunksize.
+    """
+    reader = ArrowCsvReader(file, chunksize=chunksize, **kwargs)
+    if chunksize:
+        return reader
+    with reader:
+        return reader.read()
@@ -1,26 +1,131 @@
 """
-bike system tags and selector
+bike system tags and selector.
+operators are registered by tag as 'module:Class' paths, a module is
+only imported when its operator is selected. other packages add
+operators with register() or with an entry point in the
+'biketrips.operators' group.
 """
-from biketrips import operators as ops
+import os
+import logging
+import importlib
+import threading
+from importlib.metadata import entry_points
 
+from biketrips.fetch import RETRIES
+from biketrips.lazy import preload
+from biketrips.scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
 
 SYS_LIST = ['bixi', 'bsto', 'cabi', 'citi']
+ENTRY_POINT_GROUP = 'biketrips.operators'
+OPERATORS = {
+    'bixi': 'biketrips.operators.bixi:Bixi',
+    'bsto': 'biketrips.operators.bsto:Bsto',
+    'cabi': 'biketrips.operators.cabi:Cabi',
+    'citi': 'biketrips.operators.citi:Citi',
+    }
+
+_registry = dict(OPERATORS)
+_entry_points_loaded = False
+
+
+def register(tag, operator):
+    """
+    register an operator under tag: a Trip subclass or
+    its 'module:Class' path, imported on first use.
+    """
+    _registry[tag] = operator
 
+def operators():
+    """
+    return the registry: tag -> operator class or 'module:Class' path.
+    entry points are read once, without importing their modules.
+    """
+    global _entry_points_loaded
+    if not _entry_points_loaded:
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            _registry.setdefault(entry_point.name, entry_point.value)
+        _entry_points_loaded = True
+    return _registry
+
+def operator_class(tag):
+    """
+    return the operator class registered under tag, importing its module.
+    """
+    registry = operators()
+    if tag not in registry:
+        msg = 'Wrong value for --bike-sys. {} not found in [{}]'
+        raise Exception(msg.format(tag, ', '.join(registry)))
+    operator = registry[tag]
+    if isinstance(operator, str):
+        module, _, name = operator.partition(':')
+        operator = getattr(importlib.import_module(module), name)
+        registry[tag] = operator
+    return operator
 
 def selector(args):
     """
     select relevant class given bike system
     """
-    if args['bike_sys'] == 'bixi':
-        trip = ops.bixi.Bixi(args)
-    elif args['bike_sys'] == 'bsto':
-        trip = ops.bsto.Bsto(args)
-    elif args['bike_sys'] == 'cabi':
-        trip = ops.cabi.Cabi(args)
-    elif args['bike_sys'] == 'citi':
-        trip = ops.citi.Citi(args)
-    else:
-        msg = 'Wrong value for --bike-sys. {} not found in [{}]'
-        msg = msg.format(args['bike_sys'], ', '.join(SYS_LIST))
-        raise Exception(msg)
-    return trip
+    return operator_class(args['bike_sys'])(args)
+
+def bike_sys_list(bike_sys):
+    """
+    list the tags of a --bike-sys value:
+    a tag, a comma separated list of tags or all.
+    """
+    registry = operators()
+    if bike_sys == 'all':
+        return list(registry)
+    tags = [tag.strip() for tag in bike_sys.split(',') if tag.strip()]
+    for tag in tags:
+        if tag not in registry:
+            msg = 'Wrong value for --bike-sys. {} not found in [{}]'
+            raise Exception(msg.format(tag, ', '.join(registry)))
+    return tags
+
+def run_many(args, tags):
+    """
+    run several bike systems concurrently, one thread each.
+    they share one scheduler: the process pool of args workers and
+    the download prefetcher, so the worker budget and the per host
+    limits hold for the whole run, as does memory_budget_mb.
+    each bike system writes to data_dir/tag, listings are cached
+    in data_dir/_cache.
+    """
+    if 'cache_dir' not in args:
+        args = dict(args, cache_dir=os.path.join(args['data_dir'], '_cache'))
+    trips = [
+        selector(dict(args, bike_sys=tag, data_dir=os.path.join(args['data_dir'], tag)))
+        for tag in tags]
+    failed = {}
+
+    def run(tag, trip):
+        try:
+            trip.run()
+        except Exception as err:
+            logger.exception(f'failed: {tag}')
+            failed[tag] = err
+
+    # loaded before the threads of the operators use them
+    preload('numpy', 'pandas', 'requests', 'holidays', 'bs4')
+    bandwidth = args['bandwidth_limit'] * 1024 * 1024 if 'bandwidth_limit' in args else None
+    with Scheduler(
+            workers=args.get('workers'),
+            max_per_host=args.get('max_per_host'),
+            retries=args.get('retries', RETRIES),
+            bandwidth=bandwidth,
+            operators=len(tags)) as scheduler:
+        threads = []
+        for tag, trip in zip(tags, trips):
+            trip.scheduler = scheduler
+            thread = threading.Thread(target=run, args=(tag, trip), name=tag)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    if failed:
+        msg = '{} of {} bike system(s) failed: {}'
+        raise Exception(msg.format(len(failed), len(tags), ', '.join(failed)))
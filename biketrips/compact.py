@@ -0,0 +1,301 @@
+"""
+Compaction of the chunk files of a data_dir into one file per month.
+usage: python -m biketrips.compact --data-dir ./data/bixi [--bike-sys bixi] [--force]
+"""
+import os
+import glob
+import json
+import logging
+import argparse
+
+from biketrips.lazy import lazy_import
+from biketrips.manifest import Manifest
+from biketrips.utils import LOG_FMT
+from biketrips.utils import LOG_DATEFMT
+from biketrips.writer import DEFAULT_PARTITION
+from biketrips.writer import PARTITION_COLUMNS
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+MONTHLY_DIR = 'monthly'
+INDEX_FILE = '_index.json'
+CHUNK_ROWS = 100000
+UNKNOWN = 'unknown'
+
+
+def month_key(year, month):
+    """
+    'YYYY-MM' key of a month, 'unknown' for missing values.
+    """
+    if year != year or month != month or year is None or month is None:
+        return UNKNOWN
+    return f'{int(year)}-{int(month):02d}'
+
+def source_fragments(data_dir):
+    """
+    files written for the sources marked complete in the manifest,
+    relative to data_dir. sources processed before the manifest
+    recorded outputs give the csv files of their folder.
+    """
+    fragments = []
+    for entry in Manifest(data_dir).entries():
+        if entry['status'] != 'complete':
+            continue
+        if entry['outputs']:
+            for save_name in sorted(entry['outputs'], key=chunk_order):
+                fragments.extend(entry['outputs'][save_name])
+        else:
+            source = entry['url'].split('/')[-1].split('.')[0]
+            paths = glob.glob(os.path.join(data_dir, source, 'trip_*.csv'))
+            paths = sorted(paths, key=lambda path: chunk_order(os.path.basename(path)))
+            fragments.extend(os.path.relpath(path, data_dir) for path in paths)
+    return [path for path in fragments if os.path.exists(os.path.join(data_dir, path))]
+
+def chunk_order(save_name):
+    """
+    sort key of trip_{i}_{j}.csv names by file then chunk index.
+    """
+    stem = save_name.split('.')[0]
+    return [int(part) if part.isdigit() else part for part in stem.split('_')]
+
+def signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def read_fragment(path, **kwargs):
+    """
+    csv fragment as strings, in chunks, values are written back unchanged.
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=CHUNK_ROWS, **kwargs)
+
+def chunk_keys(chunk):
+    """
+    month key of every row of a chunk.
+    """
+    years = pd.to_numeric(chunk[PARTITION_COLUMNS[0]], errors='coerce')
+    months = pd.to_numeric(chunk[PARTITION_COLUMNS[1]], errors='coerce')
+    return [month_key(year, month) for year, month in zip(years, months)]
+
+def csv_months(path):
+    """
+    month keys of the rows of a csv fragment.
+    """
+    keys = set()
+    with read_fragment(path, usecols=PARTITION_COLUMNS) as reader:
+        for chunk in reader:
+            keys.update(chunk_keys(chunk))
+    return sorted(keys)
+
+def parquet_month(path):
+    """
+    month key of a parquet fragment, from its partition folders.
+    """
+    values = {}
+    for part in path.split(os.sep):
+        name, _, value = part.partition('=')
+        if name in PARTITION_COLUMNS:
+            values[name] = float('nan') if value == DEFAULT_PARTITION else int(value)
+    return month_key(values.get(PARTITION_COLUMNS[0]), values.get(PARTITION_COLUMNS[1]))
+
+def fragment_months(data_dir, path):
+    if path.endswith('.parquet'):
+        return [parquet_month(path)]
+    return csv_months(os.path.join(data_dir, path))
+
+def update_bounds(info, values):
+    values = [value for value in values if value]
+    if values:
+        low, high = min(values), max(values)
+        info['min_start_dt'] = low if info['min_start_dt'] is None else min(info['min_start_dt'], low)
+        info['max_start_dt'] = high if info['max_start_dt'] is None else max(info['max_start_dt'], high)
+
+def compact_csv(data_dir, out_dir, bike_sys, months):
+    """
+    stream the csv fragments of every month into data_dir/monthly.
+    months maps a month key to its fragments. the columns of a month are
+    the union of those of its fragments. return the index entries.
+    """
+    columns = {}
+    for key, fragments in months.items():
+        columns[key] = []
+        for path in fragments:
+            header = pd.read_csv(os.path.join(data_dir, path), nrows=0).columns
+            columns[key].extend(column for column in header if column not in columns[key])
+
+    files, info, tmp_paths = {}, {}, {}
+    try:
+        for key in months:
+            name = f'{bike_sys}_{key}.csv'
+            tmp_paths[key] = os.path.join(out_dir, f'{name}.{os.getpid()}.tmp')
+            files[key] = open(tmp_paths[key], 'w', newline='')
+            files[key].write(','.join(columns[key]) + '\n')
+            info[key] = {
+                'file': name,
+                'fragments': months[key],
+                'columns': columns[key],
+                'rows': 0,
+                'min_start_dt': None,
+                'max_start_dt': None,
+                }
+
+        # every fragment is read once, its rows go to the months being built
+        fragments = []
+        for paths in months.values():
+            fragments.extend(path for path in paths if path not in fragments)
+        for path in fragments:
+            with read_fragment(os.path.join(data_dir, path)) as reader:
+                for chunk in reader:
+                    keys = pd.Series(chunk_keys(chunk), index=chunk.index)
+                    for key, rows in chunk.groupby(keys, sort=False).groups.items():
+                        if key not in files:
+                            continue
+                        part = chunk.loc[rows].reindex(columns=columns[key])
+                        part.to_csv(files[key], header=False, index=False)
+                        info[key]['rows'] += len(part)
+                        if 'start_dt' in part:
+                            update_bounds(info[key], part['start_dt'].dropna())
+        for key in months:
+            files[key].close()
+            os.replace(tmp_paths[key], os.path.join(out_dir, info[key]['file']))
+    finally:
+        for key, file in files.items():
+            file.close()
+            if os.path.exists(tmp_paths[key]):
+                os.remove(tmp_paths[key])
+    return info
+
+def compact_parquet(data_dir, out_dir, bike_sys, months):
+    """
+    stream the parquet fragments of every month into data_dir/monthly,
+    batch by batch. partition columns are stored back in the files.
+    return the index entries.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    info = {}
+    for key, fragments in months.items():
+        paths = [os.path.join(data_dir, path) for path in fragments]
+        schema = pa.unify_schemas([pq.read_schema(path) for path in paths], promote_options='permissive')
+        year, month = (None, None) if key == UNKNOWN else map(int, key.split('-'))
+        out_schema = schema
+        for column in PARTITION_COLUMNS:
+            if column not in schema.names:
+                out_schema = out_schema.append(pa.field(column, pa.int64()))
+        name = f'{bike_sys}_{key}.parquet'
+        tmp_path = os.path.join(out_dir, f'{name}.{os.getpid()}.tmp')
+        info[key] = {
+            'file': name,
+            'fragments': fragments,
+            'columns': out_schema.names,
+            'rows': 0,
+            'min_start_dt': None,
+            'max_start_dt': None,
+            }
+        try:
+            with pq.ParquetWriter(tmp_path, out_schema, compression='zstd') as writer:
+                for path in paths:
+                    for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK_ROWS):
+                        columns = []
+                        for field in out_schema:
+                            if field.name in batch.schema.names:
+                                columns.append(batch.column(field.name).cast(field.type))
+                            elif field.name == PARTITION_COLUMNS[0]:
+                                columns.append(pa.array([year] * len(batch), field.type))
+                            elif field.name == PARTITION_COLUMNS[1]:
+                                columns.append(pa.array([month] * len(batch), field.type))
+                            else:
+                                columns.append(pa.nulls(len(batch), field.type))
+                        table = pa.Table.from_arrays(columns, schema=out_schema)
+                        writer.write_table(table)
+                        info[key]['rows'] += len(table)
+                        if 'start_dt' in table.column_names and table['start_dt'].null_count < len(table):
+                            bounds = pc.min_max(table['start_dt'])
+                            update_bounds(info[key], [str(bounds['min']), str(bounds['max'])])
+            os.replace(tmp_path, os.path.join(out_dir, name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return info
+
+def compact(data_dir, bike_sys=None, force=False):
+    """
+    compact the chunk files of the complete sources of data_dir into one
+    file per month in data_dir/monthly, csv and parquet files apart.
+    only the months with new, changed or removed chunk files are
+    rebuilt, unless force. months files are written atomically and
+    recorded in monthly/_index.json with their chunk files, columns,
+    rows and start_dt range. return the index.
+    """
+    if bike_sys is None:
+        bike_sys = os.path.basename(os.path.normpath(data_dir))
+    out_dir = os.path.join(data_dir, MONTHLY_DIR)
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    index = {'fragments': {}, 'files': {}}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+    os.makedirs(out_dir, exist_ok=True)
+
+    fragments = {}
+    affected = set()
+    for path in source_fragments(data_dir):
+        sig = signature(os.path.join(data_dir, path))
+        old = index['fragments'].get(path)
+        if not force and old is not None and old['size'] == sig['size'] and old['mtime_ns'] == sig['mtime_ns']:
+            fragments[path] = old
+            continue
+        fragments[path] = dict(sig, months=fragment_months(data_dir, path))
+        affected.update((path.endswith('.parquet'), key) for key in fragments[path]['months'])
+        if old is not None:
+            affected.update((path.endswith('.parquet'), key) for key in old['months'])
+    for path, old in index['fragments'].items():
+        if path not in fragments:
+            affected.update((path.endswith('.parquet'), key) for key in old['months'])
+
+    for is_parquet in [False, True]:
+        months = {}
+        for parquet, key in sorted(affected):
+            if parquet != is_parquet:
+                continue
+            months[key] = [
+                path for path in fragments
+                if path.endswith('.parquet') == is_parquet and key in fragments[path]['months']]
+        extension = 'parquet' if is_parquet else 'csv'
+        for key in [key for key in months if not months[key]]:
+            # every chunk file of the month is gone
+            del months[key]
+            name = f'{bike_sys}_{key}.{extension}'
+            index['files'].pop(name, None)
+            if os.path.exists(os.path.join(out_dir, name)):
+                os.remove(os.path.join(out_dir, name))
+        if not months:
+            continue
+        if is_parquet:
+            info = compact_parquet(data_dir, out_dir, bike_sys, months)
+        else:
+            info = compact_csv(data_dir, out_dir, bike_sys, months)
+        for entry in info.values():
+            index['files'][entry.pop('file')] = entry
+            logger.info(f'compacted {len(entry["fragments"])} file(s), {entry["rows"]} rows')
+
+    index['fragments'] = fragments
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(tmp_path, index_path)
+    logger.info(f'{len(affected)} month(s) compacted in {out_dir}')
+    return index
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format=LOG_FMT, datefmt=LOG_DATEFMT)
+    parser = argparse.ArgumentParser(description='compact bike-trips chunk files by month')
+    parser.add_argument('--data-dir', type=str, help='data directory of a bike system')
+    parser.add_argument('--bike-sys', type=str, default=None, help='bike system tag, defaults to the data_dir name')
+    parser.add_argument('--force', action='store_true', help='rebuild every month')
+    parsed_args = parser.parse_args()
+    compact(parsed_args.data_dir, parsed_args.bike_sys, parsed_args.force)
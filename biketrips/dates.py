@@ -0,0 +1,119 @@
+"""
+Date dimension shared by all the chunks and files of a run.
+Class: DateDimension
+"""
+import os
+import logging
+
+from biketrips.lazy import lazy_import
+from biketrips.utils import datetime_parts
+from biketrips.utils import get_calendar_holidays
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+DATE_PARTS = ['year', 'month', 'day', 'day_of_week']
+HOLIDAY_COLUMNS = ['next_delay', 'next_holiday', 'prev_delay', 'prev_holiday']
+
+
+def date_keys(values):
+    """
+    integer date keys (days since 1970-01-01) of a datetime64 array.
+    NaT entries get the smallest int64.
+    """
+    return np.asarray(values, dtype='datetime64[D]').astype(np.int64)
+
+
+class DateDimension:
+    """
+    calendar table with one row per date of a range of years:
+    year, month, day, day_of_week, next/prev holiday and delay.
+    rows are indexed by date key, so dates are joined with a vectorized
+    take instead of a merge. the range grows when dates outside of it
+    are requested.
+    """
+    def __init__(self, holidays, years=()):
+        self.holidays = holidays
+        self.table = None
+        self.first_key = 0
+        if len(years) > 0:
+            self.build(min(years), max(years))
+
+    def build(self, first_year, last_year):
+        """
+        compute the table for all dates from first_year to last_year.
+        """
+        days = np.arange(
+            np.datetime64(f'{first_year}-01-01'),
+            np.datetime64(f'{last_year + 1}-01-01'),
+            dtype='datetime64[D]')
+        table = get_calendar_holidays(days, self.holidays).reset_index(drop=True)
+        parts = datetime_parts(days)
+        for part in DATE_PARTS:
+            table[part] = parts[part]
+        table['date_key'] = date_keys(days)
+        self.table = table[['date_key', 'dt'] + DATE_PARTS + HOLIDAY_COLUMNS]
+        self.first_key = table['date_key'].iloc[0]
+        logger.info(f'date dimension built for {first_year}-{last_year}')
+
+    @property
+    def years(self):
+        if self.table is None:
+            return range(0)
+        return range(self.table['year'].iloc[0], self.table['year'].iloc[-1] + 1)
+
+    def positions(self, keys):
+        """
+        row positions of date keys, -1 for missing dates.
+        the table is extended to cover every valid key.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        valid = keys != np.iinfo(np.int64).min
+        if valid.any():
+            bounds = np.array([keys[valid].min(), keys[valid].max()], dtype='datetime64[D]')
+            first_year, last_year = bounds.astype('datetime64[Y]').astype(np.int64) + 1970
+            if first_year not in self.years or last_year not in self.years:
+                covered = list(self.years) + [first_year, last_year]
+                self.build(min(covered), max(covered))
+        return np.where(valid, keys - self.first_key, -1)
+
+    def take(self, keys, columns):
+        """
+        return a dict of arrays with the given columns for each date key.
+        missing dates give NaN.
+        """
+        positions = self.positions(keys)
+        missing = positions < 0
+        if self.table is None:
+            return {column: np.full(len(positions), np.nan) for column in columns}
+        res = {}
+        for column in columns:
+            values = self.table[column].values.take(positions.clip(min=0))
+            if missing.any():
+                values = pd.Series(values).where(~missing).values
+            res[column] = values
+        return res
+
+    def save(self, path):
+        """
+        write the table to csv, atomically.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        self.table.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, holidays, years=()):
+        """
+        read a table written by save.
+        it is rebuilt if it does not cover years.
+        """
+        dates = cls(holidays)
+        dates.table = pd.read_csv(path, parse_dates=['dt'])
+        dates.first_key = dates.table['date_key'].iloc[0]
+        if any(year not in dates.years for year in years):
+            covered = list(dates.years) + list(years)
+            dates.build(min(covered), max(covered))
+        return dates
@@ -0,0 +1,126 @@
+"""
+Discovery of source files: cached web pages and paginated S3 listings.
+Class: ListingCache
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+
+from biketrips.fetch import get_response
+from biketrips.fetch import get_text
+
+logger = logging.getLogger(__name__)
+
+TTL = 3600
+
+
+class ListingCache:
+    """
+    on-disk cache of web pages, one json file per url in cache_dir.
+    a page younger than ttl seconds is served without any request,
+    an older one is revalidated with a conditional GET
+    (If-None-Match / If-Modified-Since). a stale page is served if the
+    revalidation fails.
+    """
+    def __init__(self, cache_dir, ttl=TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def entry_path(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def read(self, url):
+        path = self.entry_path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def write(self, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.entry_path(entry['url'])
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+
+    def get(self, url):
+        """
+        return the content of url as text.
+        """
+        entry = self.read(url)
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            return entry['text']
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = get_response(url, headers=headers)
+        except Exception as err:
+            if entry is None:
+                raise
+            logger.warning(f'{url}: {err!r}, using cached copy')
+            return entry['text']
+
+        if response.status_code == 304:
+            logger.info(f'not modified: {url}')
+        else:
+            entry = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'text': response.text,
+                }
+        entry['fetched_at'] = time.time()
+        self.write(entry)
+        return entry['text']
+
+
+def fetch_page(url, cache=None):
+    """
+    get a web page as text, through cache if given.
+    """
+    if cache is None:
+        return get_text(url)
+    return cache.get(url)
+
+def strip_namespace(tag):
+    return tag.split('}')[-1]
+
+def list_s3_keys(url, cache=None):
+    """
+    list all the keys of an S3 bucket listing at url.
+    listings are truncated to 1000 keys, the next pages are requested
+    with the continuation token (ListObjectsV2) or the marker (V1).
+    """
+    keys = []
+    page_url = url
+    while True:
+        root = ElementTree.fromstring(fetch_page(page_url, cache))
+        fields = {}
+        for element in root:
+            tag = strip_namespace(element.tag)
+            if tag == 'Contents':
+                for child in element:
+                    if strip_namespace(child.tag) == 'Key':
+                        keys.append(child.text)
+            else:
+                fields[tag] = element.text
+        if fields.get('IsTruncated') != 'true' or not keys:
+            break
+        if fields.get('NextContinuationToken'):
+            params = {'list-type': 2, 'continuation-token': fields['NextContinuationToken']}
+        else:
+            params = {'marker': fields.get('NextMarker') or keys[-1]}
+        page_url = url + ('&' if '?' in url else '?') + urlencode(params)
+    logger.info(f'{len(keys)} keys listed from {url}')
+    return keys
@@ -0,0 +1,307 @@
+"""
+HTTP tools: a shared session, streaming resumable downloads
+and an asyncio scheduler prefetching downloads.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from biketrips.lazy import lazy_import
+
+requests = lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+TIMEOUT = 60
+RETRIES = 3
+BACKOFF = 1.0
+
+_session = None
+_session_pid = None
+
+
+def get_session():
+    """
+    return the requests session of the current process.
+    connections are kept alive and reused between calls.
+    a new session is created after a fork.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session, _session_pid = session, os.getpid()
+    return _session
+
+def is_retryable(err):
+    """
+    tell if a failed request is worth retrying:
+    network errors and server side (5xx) errors.
+    """
+    if isinstance(err, requests.HTTPError):
+        return err.response is not None and err.response.status_code >= 500
+    return isinstance(err, (requests.ConnectionError, requests.Timeout, IOError))
+
+def backoff_delay(attempt, backoff=BACKOFF):
+    """
+    exponential backoff delay in seconds before retry number attempt.
+    """
+    return backoff * 2 ** attempt
+
+def get_response(url, headers=None, retries=RETRIES, backoff=BACKOFF):
+    """
+    GET url, retrying on failures. 304 Not Modified is a success.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = get_session().get(url, headers=headers, timeout=TIMEOUT)
+            response.raise_for_status()
+            return response
+        except Exception as err:
+            if attempt == retries or not is_retryable(err):
+                raise
+            logger.warning(f'{url}: {err!r}, retrying')
+            time.sleep(backoff_delay(attempt, backoff))
+
+def get_text(url, retries=RETRIES, backoff=BACKOFF):
+    """
+    get the content of a web page as text, retrying on failures.
+    """
+    return get_response(url, retries=retries, backoff=backoff).text
+
+def remote_info(url):
+    """
+    return the validators of url from a HEAD request:
+    etag, last_modified and size. None if the request fails.
+    """
+    try:
+        response = get_session().head(url, allow_redirects=True, timeout=TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as err:
+        logger.warning(f'{url}: {err!r}')
+        return None
+    size = response.headers.get('Content-Length')
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'size': int(size) if size is not None else None,
+        }
+
+
+class Throttle:
+    """
+    cap the total rate in bytes/s of the downloads sharing this object.
+    every block reserves a time slot, the caller sleeps until its slot
+    is less than a second ahead.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.clock = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self.lock:
+            now = time.monotonic()
+            self.clock = max(self.clock, now - 1) + nbytes / self.rate
+            delay = self.clock - now - 1
+        if delay > 0:
+            time.sleep(delay)
+
+
+def partial_paths(file_path):
+    """
+    paths of the partial download of file_path and of the validator
+    of the source it is downloaded from.
+    """
+    part_path = file_path + '.part'
+    return part_path, part_path + '.validator'
+
+def remove_partial(file_path):
+    """
+    remove the partial download of file_path, if any.
+    """
+    for path in partial_paths(file_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def response_validator(response):
+    """
+    validator of a response usable in If-Range: its strong etag,
+    else its last modification date. None if it has neither.
+    """
+    etag = response.headers.get('ETag')
+    if etag is not None and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+def download_file(url, file_path, block_size=BLOCK_SIZE, throttle=None):
+    """
+    stream url to file_path in blocks of block_size bytes.
+    data goes to file_path + '.part' which is renamed once complete,
+    the validator of the source is saved next to it. an existing
+    partial file is resumed with an HTTP Range request sent with
+    If-Range, one not matching the source any more, or of a source
+    without validator, is downloaded again.
+    throttle optionally caps the transfer rate.
+    """
+    part_path, validator_path = partial_paths(file_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = None
+    if offset and os.path.exists(validator_path):
+        with open(validator_path, 'r') as file:
+            validator = file.read()
+    if offset and not validator:
+        logger.warning(f'{url}: partial file of an unknown version of the source, restarting')
+        remove_partial(file_path)
+        offset = 0
+    # the server sends the whole source if it changed since the partial file
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else {}
+
+    with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 416:
+            # nothing left to read if the partial file is already complete
+            total = response.headers.get('Content-Range', '').split('/')[-1]
+            if total.isdigit() and int(total) == offset:
+                os.replace(part_path, file_path)
+                remove_partial(file_path)
+                return file_path
+            # the source was republished smaller than the partial file
+            logger.warning(f'{url}: partial file of {offset} bytes does not match the source, restarting')
+            remove_partial(file_path)
+            response.close()
+            return download_file(url, file_path, block_size=block_size, throttle=throttle)
+        if response.status_code == 206:
+            if response_validator(response) not in [None, validator]:
+                # a server ignoring If-Range sends a part of the new source
+                logger.warning(f'{url}: source changed since the partial file, restarting')
+                remove_partial(file_path)
+                response.close()
+                return download_file(url, file_path, block_size=block_size, throttle=throttle)
+            mode = 'ab'
+            logger.info(f'resuming download at byte {offset}')
+        else:
+            response.raise_for_status()
+            mode = 'wb'
+            offset = 0
+            remove_partial(file_path)
+            validator = response_validator(response)
+            if validator is not None:
+                with open(validator_path, 'w') as file:
+                    file.write(validator)
+
+        expected = response.headers.get('Content-Length')
+        if expected is not None and 'Content-Encoding' not in response.headers:
+            expected = int(expected) + offset
+        else:
+            expected = None
+
+        with open(part_path, mode) as file:
+            for block in response.iter_content(chunk_size=block_size):
+                file.write(block)
+                if throttle is not None:
+                    throttle.consume(len(block))
+
+    size = os.path.getsize(part_path)
+    if expected is not None and size != expected:
+        raise IOError(f'incomplete download of {url}: {size} of {expected} bytes')
+    os.replace(part_path, file_path)
+    remove_partial(file_path)
+    return file_path
+
+def fetch_file(url, file_path, retries=RETRIES, backoff=BACKOFF, throttle=None):
+    """
+    download url to file_path, retrying on failures.
+    every retry resumes the partial file.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return download_file(url, file_path, throttle=throttle)
+        except Exception as err:
+            if attempt == retries or not is_retryable(err):
+                raise
+            logger.warning(f'{url}: {err!r}, retrying')
+            time.sleep(backoff_delay(attempt, backoff))
+
+
+class Prefetcher:
+    """
+    download files ahead of their processing.
+    an asyncio loop in a background thread keeps at most max_per_host
+    downloads in flight per host, the blocking transfers run in a thread
+    pool. failures are retried with exponential backoff, resuming the
+    partial file. throttle caps the total rate of the transfers.
+    """
+    def __init__(self, max_per_host=4, retries=RETRIES, backoff=BACKOFF, throttle=None):
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.throttle = throttle
+        self.semaphores = {}
+        self.futures = {}
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=4 * max_per_host,
+            thread_name_prefix='prefetch')
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def fetch(self, url, file_path):
+        """
+        download url to file_path once a slot for its host is free.
+        """
+        host = urlparse(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        async with self.semaphores[host]:
+            return await self.loop.run_in_executor(
+                self.executor,
+                fetch_file,
+                url,
+                file_path,
+                self.retries,
+                self.backoff,
+                self.throttle)
+
+    def submit(self, url, file_path):
+        """
+        schedule the download of url to file_path.
+        """
+        if url not in self.futures:
+            coro = self.fetch(url, file_path)
+            self.futures[url] = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return self.futures[url]
+
+    def wait(self, url):
+        """
+        wait for the download of url to end.
+        return the downloaded file path or None if it failed.
+        """
+        try:
+            return self.futures.pop(url).result()
+        except Exception as err:
+            logger.warning(f'prefetch failed: {url}: {err!r}')
+            return None
+
+    def close(self):
+        """
+        cancel pending downloads and stop the loop.
+        """
+        for future in self.futures.values():
+            future.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
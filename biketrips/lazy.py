@@ -0,0 +1,32 @@
+"""
+Lazy imports of heavy modules, loaded on first attribute access.
+"""
+import sys
+import importlib
+import importlib.util
+
+
+def lazy_import(name):
+    """
+    return module name, executed only when one of its attributes is
+    first used. an already imported module is returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}')
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def preload(*names):
+    """
+    load lazy modules now. lazy loading is not thread safe before
+    python 3.12, modules are loaded before threads may race to do it.
+    """
+    for name in names:
+        getattr(importlib.import_module(name), '__name__')
@@ -0,0 +1,225 @@
+"""
+Cooperation of processes and hosts sharing a data_dir, without coordinator:
+urls are hash partitioned in shards and leased while processed.
+Class: Leases
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+LEASE_DIR = '_leases'
+# seconds without renewal after which a lease is stale
+TTL = 600
+POLL = 1.0
+
+
+def parse_shard(value):
+    """
+    (index, count) of a shard given as 'i/N' or [i, N], i from 0 to N-1.
+    """
+    try:
+        if isinstance(value, str):
+            value = value.split('/')
+        index, count = (int(part) for part in value)
+    except (TypeError, ValueError):
+        raise Exception(f'Wrong value for shard. {value} is not i/N')
+    if not 0 <= index < count:
+        raise Exception(f'Wrong value for shard. {index}/{count}: i must be in [0, N-1]')
+    return index, count
+
+def in_shard(url, shard):
+    """
+    tell if url belongs to shard, from a hash of its file name, so that
+    every host computes the same partition of the same url plan.
+    """
+    index, count = shard
+    digest = hashlib.sha1(url.split('/')[-1].encode()).hexdigest()
+    return int(digest, 16) % count == index
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # exists, owned by another user
+        return True
+    return True
+
+
+class Leases:
+    """
+    leases on named resources (urls, shared files) of a data_dir.
+    a lease is a file of path created exclusively (O_EXCL, also atomic
+    on NFS) holding its owner. a thread renews the mtime of the leases
+    held every ttl/4. a lease not renewed for ttl seconds, or held by a
+    dead process of this host, is stale and taken over.
+    """
+    def __init__(self, path, ttl=TTL):
+        self.path = path
+        self.ttl = ttl
+        self.owner = json.dumps({
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'token': uuid.uuid4().hex})
+        self.held = set()
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __getstate__(self):
+        # a copy sent to a pool worker checks the leases, it does not renew them
+        state = self.__dict__.copy()
+        del state['lock']
+        del state['stop']
+        state['thread'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def lease_path(self, name):
+        return os.path.join(self.path, f'{name}.lease')
+
+    def holder(self, path):
+        """
+        content of a lease file, None if there is none.
+        """
+        try:
+            with open(path, 'r') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def stale(self, path, content):
+        try:
+            age = time.time() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        if age > self.ttl:
+            return True
+        try:
+            holder = json.loads(content)
+        except ValueError:
+            # being written, or truncated by a crash
+            return age > POLL
+        return holder['host'] == socket.gethostname() and not alive(holder['pid'])
+
+    def take_over(self, path, content):
+        """
+        remove the stale lease path holding content. the lease is moved
+        aside first, only one of the processes taking it over succeeds,
+        and it is put back if it was renewed by someone else meanwhile.
+        """
+        grave = f'{path}.{uuid.uuid4().hex}.stale'
+        try:
+            os.rename(path, grave)
+        except FileNotFoundError:
+            return
+        if self.holder(grave) != content:
+            try:
+                os.link(grave, path)
+            except FileExistsError:
+                pass
+        os.remove(grave)
+        logger.warning(f'stale lease taken over: {path} {content}')
+
+    def try_acquire(self, name):
+        path = self.lease_path(name)
+        os.makedirs(self.path, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                content = self.holder(path)
+                if content == self.owner:
+                    return True
+                if content is None:
+                    continue
+                if not self.stale(path, content):
+                    return False
+                self.take_over(path, content)
+                continue
+            with os.fdopen(fd, 'w') as file:
+                file.write(self.owner)
+            return True
+        return False
+
+    def acquire(self, name, wait=None):
+        """
+        lease name, waiting at most wait seconds (None: no wait) for its
+        holder to release it. return True if it is held.
+        """
+        deadline = None if wait is None else time.monotonic() + wait
+        while True:
+            if self.try_acquire(name):
+                with self.lock:
+                    self.held.add(name)
+                    self.lost.discard(name)
+                    if self.thread is None:
+                        self.thread = threading.Thread(target=self.renew, name='leases', daemon=True)
+                        self.thread.start()
+                return True
+            if deadline is None or time.monotonic() > deadline:
+                return False
+            time.sleep(POLL)
+
+    def release(self, name):
+        with self.lock:
+            if name not in self.held:
+                return
+            self.held.discard(name)
+        path = self.lease_path(name)
+        if self.holder(path) == self.owner:
+            os.remove(path)
+
+    def holds(self, name):
+        """
+        tell if the lease name is still held. a lease taken over by
+        another process meanwhile is recorded as lost.
+        """
+        with self.lock:
+            if name in self.lost:
+                return False
+        path = self.lease_path(name)
+        if self.holder(path) == self.owner:
+            return True
+        logger.error(f'lease lost: {path}')
+        with self.lock:
+            self.held.discard(name)
+            self.lost.add(name)
+        return False
+
+    def renew(self):
+        while not self.stop.wait(self.ttl / 4):
+            with self.lock:
+                names = list(self.held)
+            for name in names:
+                if self.holds(name):
+                    os.utime(self.lease_path(name))
+
+    def close(self):
+        """
+        release every lease held.
+        """
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        for name in list(self.held):
+            self.release(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -3,17 +3,66 @@ Meta tools processing data
 Class: Trip
 """
 import os
+import re
+import shutil
 from abc import ABC, abstractmethod
+import time
 import logging
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
 from zipfile import ZipFile
 
-import pandas as pd
-import requests
-
+from biketrips.aggregates import PARTIAL_DIR
+from biketrips.aggregates import REQUIRED_COLUMNS as AGGREGATE_COLUMNS
+from biketrips.aggregates import merge as merge_aggregates
+from biketrips.aggregates import write_partials
+from biketrips.arrow_csv import parse_engine
+from biketrips.compact import compact
+from biketrips.dates import DateDimension
+from biketrips.dates import HOLIDAY_COLUMNS
+from biketrips.dates import date_keys
+from biketrips.discovery import list_s3_keys
+from biketrips.discovery import ListingCache
+from biketrips.discovery import TTL
+from biketrips.fetch import fetch_file
+from biketrips.fetch import RETRIES
+from biketrips.fetch import Throttle
+from biketrips.fetch import remote_info
+from biketrips.fetch import remove_partial
+from biketrips.lazy import lazy_import
+from biketrips.lazy import preload
+from biketrips.lease import LEASE_DIR
+from biketrips.lease import Leases
+from biketrips.lease import TTL as LEASE_TTL
+from biketrips.lease import in_shard
+from biketrips.lease import parse_shard
+from biketrips.manifest import Manifest
+from biketrips.memory import ChunkSizer
+from biketrips.memory import PROBE_ROWS
+from biketrips.memory import chunk_budget
+from biketrips.metrics import Metrics
+from biketrips.pipeline import DEPTH as PIPELINE_DEPTH
+from biketrips.pipeline import Pipeline
+from biketrips.scheduler import Scheduler
+from biketrips.star import DATE_DIM_FILE
+from biketrips.star import KEY_COLUMNS
+from biketrips.star import STATION_SIDES
+from biketrips.star import merge_stations
+from biketrips.star import normalize
+from biketrips.star import station_columns
+from biketrips.star import write_versions
+from biketrips.stations import StationIndex
 from biketrips.utils import docs_from_url
+from biketrips.utils import datetime_parts
 from biketrips.utils import format_column_names
-from biketrips.utils import get_calendar_holidays
+from biketrips.utils import parse_datetime
 from biketrips.utils import walk_dir
+from biketrips.utils import zip_members
+from biketrips.writer import PARTITION_COLUMNS
+from biketrips.writer import make_writer
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 logger = logging.getLogger(__name__)
 
@@ -45,13 +94,187 @@ RENAME_DICT = {
     'end_station_name': 'end_name',
     }
 
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    ]
+
+# names of the chunk files written in the folder of a source,
+# the first group is the index of the raw file of the chunk
+OUTPUT_NAME = re.compile(r'trip_(\d+)(_\d+)?\.(csv|parquet)$')
+
+# lease of the files updated from all the urls of a data_dir
+FINALIZE_LEASE = 'finalize'
+
+DATETIME_PARTS = [
+    'dt',
+    'year',
+    'month',
+    'day',
+    'hour',
+    'minute',
+    'second',
+    'time_ratio',
+    'day_of_week',
+    ]
+# integer datetime parts are downcast when a columns projection is set
+PART_DTYPES = {
+    'year': 'Int16',
+    'month': 'Int8',
+    'day': 'Int8',
+    'hour': 'Int8',
+    'minute': 'Int8',
+    'second': 'Int8',
+    }
+
 
 class Trip(ABC):
     """
     Base class for processing data
     """
-    def __init__(self, data_dir):
+    bike_sys = None
+
+    def __init__(self, data_dir, args=None):
         self.data_dir = data_dir
+        self.datetime_formats = DATETIME_FORMATS
+        self.format_cache = {}
+        self.dates = None
+        self.scheduler = None
+        self.throttle = None
+        self.leases = None
+        self.chunk_budget = None
+        if args is None:
+            args = {}
+        if 'workers' in args:
+            self.workers = args['workers']
+        else:
+            self.workers = None
+        if 'max_per_host' in args:
+            self.max_per_host = args['max_per_host']
+        else:
+            self.max_per_host = None
+        if 'bandwidth_limit' in args:
+            self.bandwidth = args['bandwidth_limit'] * 1024 * 1024
+        else:
+            self.bandwidth = None
+        if 'retries' in args:
+            self.retries = args['retries']
+        else:
+            self.retries = RETRIES
+        if 'unzip' in args:
+            self.unzip = args['unzip']
+        else:
+            self.unzip = True
+        if 'keep_archive' in args:
+            self.keep_archive = args['keep_archive']
+        else:
+            self.keep_archive = True
+        if 'memory_budget_mb' in args:
+            self.memory_budget = args['memory_budget_mb']
+        else:
+            self.memory_budget = None
+        if 'compact' in args:
+            self.compaction = args['compact']
+        else:
+            self.compaction = False
+        if 'aggregates' in args:
+            self.aggregation = args['aggregates']
+        else:
+            self.aggregation = False
+        if 'columns' in args:
+            self.columns = args['columns']
+        else:
+            self.columns = None
+        if 'star_schema' in args:
+            self.star_schema = args['star_schema']
+        else:
+            self.star_schema = False
+        if 'date_dim' in args:
+            self.save_dates = args['date_dim']
+        else:
+            self.save_dates = False
+        # star schema trips refer to the saved date dimension
+        self.save_dates = self.save_dates or self.star_schema
+        if 'shard' in args and args['shard'] is not None:
+            self.shard = parse_shard(args['shard'])
+        else:
+            self.shard = None
+        if 'lease_ttl' in args:
+            self.lease_ttl = args['lease_ttl']
+        else:
+            self.lease_ttl = LEASE_TTL
+        if 'parse_engine' in args:
+            self.parse_engine = parse_engine(args['parse_engine'])
+        else:
+            self.parse_engine = 'pandas'
+        self.writer = make_writer(data_dir, self.bike_sys, args)
+        self.manifest = Manifest(data_dir)
+        self.output_columns, self.computed_columns = self.projection()
+        if 'cache_dir' in args:
+            cache_dir = args['cache_dir']
+        else:
+            cache_dir = os.path.join(data_dir, '_cache')
+        if 'listing_ttl' in args:
+            self.listing_cache = ListingCache(cache_dir, args['listing_ttl'])
+        else:
+            self.listing_cache = ListingCache(cache_dir, TTL)
+        if 'metrics' in args:
+            self.metrics = Metrics(args['metrics'], self.bike_sys)
+        else:
+            self.metrics = Metrics(None, self.bike_sys)
+
+    def __getstate__(self):
+        # the scheduler and its throttle stay in the parent process
+        state = self.__dict__.copy()
+        state['scheduler'] = None
+        state['throttle'] = None
+        return state
+
+    def required_columns(self):
+        """
+        columns the writer and the compaction need in the written chunks.
+        """
+        required = list(self.writer.required_columns)
+        if self.compaction:
+            required.extend(column for column in PARTITION_COLUMNS if column not in required)
+        return required
+
+    def projection(self):
+        """
+        columns written and columns computed for the columns option,
+        None for every column. the writer, the compaction and the
+        aggregates need some columns that are computed and not written,
+        or written and not requested. star schema keys are computed
+        from the station codes and attributes and from the dates.
+        """
+        if self.columns is None:
+            return None, None
+        output = list(self.columns)
+        required = self.required_columns()
+        if self.star_schema:
+            required.extend(KEY_COLUMNS)
+        output.extend(column for column in required if column not in output)
+        computed = set(output)
+        if self.aggregation:
+            computed.update(AGGREGATE_COLUMNS)
+        if computed & set(HOLIDAY_COLUMNS):
+            computed.add('start_dt')
+        if self.star_schema:
+            computed.update(['start_dt', 'end_dt'])
+            for code_column, columns in STATION_SIDES.values():
+                computed.update([code_column] + list(columns))
+        return output, computed
+
+    def project(self, trip_df):
+        """
+        columns of trip_df to write.
+        """
+        if self.output_columns is None:
+            return trip_df
+        return trip_df[[column for column in self.output_columns if column in trip_df]]
 
     @staticmethod
     def href_filter(url_list, years_list):
@@ -66,8 +289,8 @@ class Trip(ABC):
         return res
 
     @staticmethod
-    def get_url_list(url, search_cfg, attr=None, tag='href', prefix=''):
-        docs = docs_from_url(url, search_cfg)
+    def get_url_list(url, search_cfg, attr=None, tag='href', prefix='', cache=None):
+        docs = docs_from_url(url, search_cfg, cache)
         url_list = []
         if attr:
             url_list = [getattr(doc, attr) for doc in docs]
@@ -76,150 +299,764 @@ class Trip(ABC):
         return [os.path.join(prefix, url) for url in url_list]
 
     @staticmethod
-    def break_datetime(data, columns):
+    def get_s3_url_list(url, prefix='', cache=None):
+        """
+        list the urls of all the files of an S3 bucket listing.
+        """
+        return [os.path.join(prefix, key) for key in list_s3_keys(url, cache)]
+
+    @staticmethod
+    def break_datetime(data, columns, formats=(), cache=None, unique=False, dates=None, outputs=None, dtypes=None):
         """
         given a datetime string column of a dataframe, create new columns
         representing various dims of datetime (year, month, day, hour ...)
+        strings are parsed with the first matching format of formats,
+        cache remembers the format settled for each column.
+        if unique is True components are computed once per distinct
+        timestamp and broadcast back to the rows.
+        date components come from the date dimension dates if given.
+        if outputs is given only the columns it holds are created.
+        dtypes maps components to the dtype they are cast to.
         """
         for column in columns:
             name = column.replace('date', '')
-            series = pd.to_datetime(data[column]).copy()
-            data[name + 'dt'] = series.dt.date
-            data[name + 'year'] = series.dt.year
-            data[name + 'month'] = series.dt.month
-            data[name + 'day'] = series.dt.day
-            data[name + 'hour'] = series.dt.hour
-            data[name + 'minute'] = series.dt.minute
-            data[name + 'second'] = series.dt.second
-            time_ratio = (series.dt.hour + series.dt.minute/60 + series.dt.second/3600)/24
-            data[name + 'time_ratio'] = time_ratio
-            data[name + 'day_of_week'] = series.map(lambda dt: dt.isoweekday())
+            parts = [part for part in DATETIME_PARTS if outputs is None or name + part in outputs]
+            if not parts:
+                data.drop(column, axis=1, inplace=True)
+                continue
+            if unique:
+                codes, values = pd.factorize(data[column])
+                values = np.asarray(
+                    parse_datetime(values, formats, cache, column),
+                    dtype='datetime64[s]')
+                if (codes < 0).any():
+                    # missing timestamps point to a trailing NaT
+                    values = np.append(values, np.datetime64('NaT'))
+                    codes[codes < 0] = len(values) - 1
+            else:
+                values = parse_datetime(data[column].values, formats, cache, column)
+            values = datetime_parts(values, dates, parts)
+            for part in parts:
+                value = values[part].take(codes) if unique else values[part]
+                if dtypes is not None and part in dtypes:
+                    value = pd.array(value, dtype=dtypes[part])
+                data[name + part] = value
             data.drop(column, axis=1, inplace=True)
         return data
 
+    @abstractmethod
+    def find_urls(self):
+        """
+        list the urls of the trip files of the requested years.
+        """
+
+    def plan(self, url_list):
+        """
+        return (url, status) pairs telling what a run would do with
+        every url: 'new', 'processing' (resumed), 'complete' (skipped)
+        or 'unsupported'. nothing is downloaded.
+        only the urls of the shard are planned.
+        """
+        res = []
+        for url in self.shard_urls(url_list):
+            if url.split('.')[-1] not in ['zip', 'csv']:
+                res.append((url, 'unsupported'))
+                continue
+            entry = self.manifest.get(url)
+            res.append((url, 'new' if entry is None else entry['status']))
+        return res
+
+    def shard_urls(self, url_list):
+        """
+        urls of url_list in the shard of this process, all without shard.
+        """
+        if self.shard is None:
+            return url_list
+        urls = [url for url in url_list if in_shard(url, self.shard)]
+        logger.info('shard {}/{}: {} of {} url(s)'.format(*self.shard, len(urls), len(url_list)))
+        return urls
+
+    def source_paths(self, url):
+        """
+        return the path of the file downloaded from url
+        and the folder where its data is saved.
+        """
+        file_name = url.split('/')[-1]
+        save_dir = os.path.join(self.data_dir, file_name.split('.')[0])
+        return os.path.join(self.data_dir, file_name), save_dir
+
+    def needs_download(self, url):
+        """
+        tell if url points to a supported file not downloaded yet.
+        """
+        file_path, save_dir = self.source_paths(url)
+        extension = file_path.split('.')[-1]
+        return extension in ['zip', 'csv'] and not os.path.exists(save_dir)
+
     def download(self, url):
         """
         get bixi trip data from internet.
         return the folder where data is saved.
+        the folder only appears once the data is fully downloaded
+        and unpacked, so an interrupted run is picked up again.
+        a file already fetched by the prefetcher is not downloaded again.
+        sources are tracked in the manifest: a complete source is skipped
+        unless it changed remotely, a partly processed one is resumed.
         """
         #download/unzip data from the web
         logger.info(f'downloading:\n {url}')
-        file_name = url.split('/')[-1]
-        save_dir = os.path.join(self.data_dir, file_name.split('.')[0])
-        file_path = os.path.join(save_dir, file_name)
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-            with open(file_path, 'wb') as file:
-                file.write(requests.get(url).content)
-            if file_name.split('.')[-1] == 'zip':
-                with ZipFile(file_path, 'r') as zip_file:
-                    zip_file.extractall(path=save_dir)
-                os.remove(file_path)
-            elif file_name.split('.')[-1] == 'csv':
-                with open(file_path, 'wb') as file:
-                    data = requests.get(url).content
-                    file.write(data)
-            else:
-                logger.info('skip unsupported extension: {}'.format(file_name.split('.')[-1]))
-                return None
-        else:
-            print('directory already exist')
+        file_path, save_dir = self.source_paths(url)
+        file_name = os.path.basename(file_path)
+        extension = file_name.split('.')[-1]
+        if extension not in ['zip', 'csv']:
+            logger.info('skip unsupported extension: {}'.format(extension))
             return None
 
-        files = walk_dir(save_dir)
-        #files = [file for file in files if file.find('.csv') > 0]
-        return save_dir, files
+        remote = remote_info(url)
+        if os.path.exists(save_dir):
+            entry = self.manifest.get(url)
+            if entry is None:
+                # processed before sources were tracked
+                self.manifest.start(url, remote, status='complete')
+                logger.info('directory already exist')
+                return None
+            if self.manifest.changed(entry, remote):
+                logger.info(f'source changed since last run, refetching: {url}')
+                shutil.rmtree(save_dir)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                remove_partial(file_path)
+            elif entry['status'] == 'complete':
+                logger.info('directory already exist')
+                return None
+            else:
+                logger.info(f'resuming processing of {url}')
+                return save_dir, self.source_files(save_dir, file_name, entry)
+
+        with self.metrics.stage('download', source=file_name) as record:
+            if not os.path.exists(file_path):
+                os.makedirs(self.data_dir, exist_ok=True)
+                fetch_file(url, file_path, retries=self.retries, throttle=self.download_throttle())
+            record['bytes'] = os.path.getsize(file_path)
+
+            tmp_dir = save_dir + '.tmp'
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            os.makedirs(tmp_dir)
+            try:
+                if extension == 'zip' and self.unzip:
+                    with ZipFile(file_path, 'r') as zip_file:
+                        zip_file.extractall(path=tmp_dir)
+                    os.remove(file_path)
+                else:
+                    os.replace(file_path, os.path.join(tmp_dir, file_name))
+            except Exception:
+                # a corrupt archive is downloaded again by the next run
+                logger.error(f'cannot unpack {file_name}, removed')
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                shutil.rmtree(tmp_dir)
+                raise
+            # the raw files are recorded before the folder appears: outputs
+            # are written next to them, and a folder without entry is
+            # taken as processed before sources were tracked
+            files = [
+                os.path.relpath(os.path.join(save_dir, os.path.relpath(path, tmp_dir)), self.data_dir)
+                for path in walk_dir(tmp_dir)]
+            entry = self.manifest.start(url, remote, files=files)
+            os.replace(tmp_dir, save_dir)
+        return save_dir, self.source_files(save_dir, file_name, entry)
+
+    def download_throttle(self):
+        """
+        throttle of the downloads of this process: the one of the run
+        scheduler, or a share of bandwidth_limit in a pool worker, which
+        downloads one url at a time.
+        """
+        if self.throttle is None and self.bandwidth:
+            self.throttle = Throttle(self.bandwidth / (self.workers or 1))
+        return self.throttle
+
+    def source_files(self, save_dir, file_name, entry):
+        """
+        list the raw data files of a downloaded source, as recorded in
+        its manifest entry. the folder also holds the outputs of the
+        chunks, entries recorded without files skip these.
+        """
+        if file_name.split('.')[-1] == 'zip' and not self.unzip:
+            # csv files are streamed from the archive
+            return zip_members(os.path.join(save_dir, file_name))
+        if 'files' in entry:
+            return [os.path.join(self.data_dir, path) for path in entry['files']]
+        written = set()
+        for paths in entry['outputs'].values():
+            written.update(os.path.join(self.data_dir, path) for path in paths)
+        return [
+            file for file in walk_dir(save_dir)
+            if file not in written
+            and os.path.basename(os.path.dirname(file)) != PARTIAL_DIR
+            and not OUTPUT_NAME.match(os.path.basename(file))]
 
-    def process(self, stations_df, trip_df, rename_dict, save_dir, save_name, holidays):
+    def process(self, stations, trip_df, rename_dict, save_dir, save_name, holidays):
+        """
+        transform a chunk and write it, return the written files.
+        """
+        trip_df = self.transform(stations, trip_df, rename_dict, save_dir, save_name, holidays)
+        return self.write(trip_df, save_dir, save_name)
+
+    def transform(self, stations, trip_df, rename_dict, save_dir, save_name, holidays):
         """
         merge stations and trip df. add datetime component.
         add time to next and previous holiday.
-        write down the result.
+        stations is a StationIndex or None.
+        datetime formats are remembered per raw file, files of
+        a source may write dates in different orders.
+        every step is recorded in metrics.
         """
+        fields = dict(source=os.path.basename(save_dir), chunk=save_name, rows=len(trip_df))
+
         # standardize column names
         format_column_names(trip_df)
         trip_df.rename(rename_dict, axis=1, inplace=True)
 
         # merge stations ad trips
-        if stations_df is not None:
-            format_column_names(stations_df)
-            stations_df.rename(rename_dict, axis=1, inplace=True)
-            trip_df = self.station_trip_join(stations_df, trip_df)
+        if stations is not None:
+            with self.metrics.stage('station_trip_join', **fields):
+                trip_df = self.station_trip_join(stations, trip_df)
 
         # add datetime elements
-        self.break_datetime(trip_df, columns=['start_date', 'end_date'])
+        if self.dates is None:
+            self.dates = DateDimension(holidays)
+        with self.metrics.stage('break_datetime', **fields):
+            raw_file = (save_dir, OUTPUT_NAME.match(save_name).group(1))
+            self.break_datetime(
+                trip_df,
+                columns=['start_date', 'end_date'],
+                formats=self.datetime_formats,
+                cache=self.format_cache.setdefault(raw_file, {}),
+                unique=True,
+                dates=self.dates,
+                outputs=self.computed_columns,
+                dtypes=None if self.columns is None else PART_DTYPES)
 
         # add holidays
-        calendar = get_calendar_holidays(
-            dt_series=trip_df['start_dt'].unique(),
-            holidays=holidays)
+        with self.metrics.stage('holidays', **fields):
+            self.add_holidays(trip_df)
+        return trip_df
 
-        trip_df = trip_df.merge(calendar, left_on='start_dt', right_on='dt', how='left')
-        trip_df.drop('dt', axis=1, inplace=True)
+    def add_holidays(self, trip_df):
+        """
+        add the delays to the next and previous holidays of the start date.
+        """
+        columns = [
+            column for column in HOLIDAY_COLUMNS
+            if self.computed_columns is None or column in self.computed_columns]
+        if columns:
+            calendar = self.dates.take(date_keys(trip_df['start_dt']), columns)
+            for column in columns:
+                trip_df[column] = calendar[column]
+        return trip_df
 
-        # write processed df to file
-        trip_df.to_csv(os.path.join(save_dir, save_name), index=False)
-        logger.info('{}: trip_df shape {}'.format(save_name, trip_df.shape))
+    def write(self, trip_df, save_dir, save_name):
+        """
+        write a processed chunk, return the written files and their stats.
+        with the aggregates option the station aggregates of the chunk
+        are written too. with the star_schema option the chunk is written
+        with station and date keys, the station versions it refers to
+        are written apart.
+        """
+        fields = dict(source=os.path.basename(save_dir), chunk=save_name, rows=len(trip_df))
+        with self.metrics.stage('write', **fields) as record:
+            out_df = trip_df
+            if self.star_schema:
+                out_df, versions = normalize(trip_df, keep=self.required_columns())
+                if versions is not None:
+                    layout = station_columns(trip_df, self.project(trip_df.iloc[:0]).columns)
+                    write_versions(versions, self.data_dir, os.path.basename(save_dir), save_name, layout)
+            paths = self.writer.write(self.project(out_df), save_dir, save_name)
+            record['bytes'] = sum(os.path.getsize(path) for path in paths)
+        if self.aggregation:
+            with self.metrics.stage('aggregate', **fields):
+                paths.update(write_partials(trip_df, save_dir, save_name))
+        logger.info('{}/{}: trip_df shape {}'.format(
+            os.path.basename(save_dir), save_name, trip_df.shape))
+        return paths
 
     @staticmethod
     @abstractmethod
-    def load(files, chunksize):
+    def load(files, chunksize, engine='pandas'):
         """
         download files from url then load as pandas df
         """
 
-    def station_trip_join(self, stations_df, trip_df):
+    def station_trip_join(self, stations, trip_df):
+        """
+        add start and end stations attributes to trip data.
+        end station attributes are suffixed with _end.
+        only the computed columns are added with the columns option.
+        """
+        for code_column, suffix in [('start_station_code', ''), ('end_station_code', '_end')]:
+            columns = [
+                column for column in stations.columns
+                if self.computed_columns is None or column + suffix in self.computed_columns]
+            if columns:
+                stations.enrich(trip_df, code_column, suffix=suffix, columns=columns)
+        return trip_df
+
+    def station_index(self, stations_df, rename_dict):
+        """
+        standardize stations data and index it by station code.
+        """
+        format_column_names(stations_df)
+        stations_df.rename(rename_dict, axis=1, inplace=True)
+        return StationIndex(stations_df)
+
+    @staticmethod
+    def iter_chunks(trip_dfs, chunksize, sizer=None):
         """
-        merge trip data and stations - place holder.
+        yield (save_name, trip_df) pairs.
+        save names only depend on file and chunk index.
+        a ChunkSizer resizes the chunks after the first one of each file.
         """
-        # merge stations and trips
-        merged_df = trip_df.merge(
-            stations_df,
-            how='left',
-            left_on='start_station_code',
-            right_on='code').drop('code', axis=1)
+        if chunksize:
+            for i, chunk_gen in enumerate(trip_dfs):
+                with chunk_gen:
+                    chunks = chunk_gen if sizer is None else sizer.chunks(chunk_gen, i)
+                    for j, chunk in enumerate(chunks):
+                        yield f'trip_{i}_{j}.csv', chunk
+        else:
+            for i, data in enumerate(trip_dfs):
+                yield f'trip_{i}.csv', data
 
-        merged_df = merged_df.merge(
-            stations_df,
-            how='left',
-            left_on='end_station_code',
-            right_on='code',
-            suffixes=('', '_end')).drop('code', axis=1)
-        return merged_df
+    def timed_chunks(self, chunks, source):
+        """
+        yield the (save_name, trip_df) pairs of chunks,
+        the reading of every chunk is recorded in metrics as load.
+        """
+        chunks = iter(chunks)
+        while True:
+            with self.metrics.stage('load', source=source) as record:
+                item = next(chunks, None)
+                if item is not None:
+                    record['chunk'] = item[0]
+                    record['rows'] = len(item[1])
+            if item is None:
+                return
+            yield item
 
-    def run_url(self, url, rename_dict, holidays, chunksize):
+    def run_task(self, method, *args, **kwargs):
+        """
+        call method in a pool worker.
+        return its result with the metrics totals it recorded.
+        """
+        res = getattr(self, method)(*args, **kwargs)
+        return res, self.metrics.totals, self.metrics.peak_rss
+
+    def task_result(self, future):
+        """
+        result of a run_task future, its metrics are merged.
+        """
+        res, totals, rss = future.result()
+        self.metrics.merge(totals, rss)
+        return res
+
+    def commit(self, url, save_name, paths):
+        """
+        record the files written for a chunk of url and their stats
+        in the manifest, station aggregates apart.
+        """
+        stats, aggregates = {}, []
+        for path in paths:
+            relpath = os.path.relpath(path, self.data_dir)
+            if 'aggregate' in paths[path]:
+                aggregates.append(relpath)
+            else:
+                stats[relpath] = paths[path]
+        self.manifest.commit(url, save_name, list(stats), stats, aggregates)
+
+    def submit_chunks(self, scheduler, chunks, url, **kwargs):
+        """
+        process chunks of url on the process pool of scheduler.
+        at most two chunks per worker are in flight to cap memory.
+        """
+        max_pending = 2 * scheduler.workers
+        pending = {}
+        failed = {}
+
+        def collect(futures):
+            for future in futures:
+                save_name = pending.pop(future)
+                if future.exception() is not None:
+                    logger.error(f'{save_name}: {future.exception()!r}')
+                    failed[save_name] = future.exception()
+                else:
+                    paths = self.task_result(future)
+                    self.check_lease(url)
+                    self.commit(url, save_name, paths)
+
+        for save_name, trip_df in chunks:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            self.check_lease(url)
+            future = scheduler.submit(
+                self.run_task,
+                'process',
+                trip_df=trip_df,
+                save_name=save_name,
+                **kwargs)
+            pending[future] = save_name
+        collect(wait(pending)[0])
+
+        if failed:
+            save_name = sorted(failed)[0]
+            msg = '{} chunk(s) failed, first: {}: {!r}'
+            raise Exception(msg.format(len(failed), save_name, failed[save_name]))
+
+    def open_chunks(self, url, save_dir, files, rename_dict, holidays, chunksize):
+        """
+        load the files of url.
+        return the generator of the chunks not committed yet
+        and the arguments of process shared by all of them.
+        """
+        source = os.path.basename(save_dir)
+
+        # with a memory budget files are probed with a small
+        # first chunk, the next ones are sized from it
+        max_rows = chunksize
+        if self.chunk_budget is not None:
+            chunksize = min(chunksize or PROBE_ROWS, PROBE_ROWS)
+        # a resumed source is cut as in its first run, whatever the
+        # chunk_size, budget, workers or parse_engine of this one
+        recorded, sized, sizes = self.manifest.chunking(url, chunksize, self.chunk_budget is not None)
+        if recorded != chunksize:
+            logger.info(f'chunks of {recorded} rows, as recorded in the manifest')
+            chunksize = recorded
+        sizer = None
+        if sized:
+            sizer = ChunkSizer(
+                self.chunk_budget,
+                max_rows=max_rows,
+                sizes=sizes,
+                on_size=lambda index, rows: self.manifest.chunk_rows(url, index, rows))
+
+        #load stations and trips data with pandas
+        with self.metrics.stage('load', source=source):
+            trip_dfs, stations_df = self.load(files, chunksize, self.parse_engine)
+            stations = None
+            if stations_df is not None:
+                stations = self.station_index(stations_df, rename_dict)
+
+        # chunks committed by a previous run are not processed again
+        committed = self.manifest.committed(url)
+        if committed:
+            logger.info(f'{len(committed)} chunk(s) already committed')
+        chunks = (
+            (save_name, trip_df)
+            for save_name, trip_df in self.timed_chunks(self.iter_chunks(trip_dfs, chunksize, sizer), source)
+            if save_name not in committed)
+        kwargs = dict(
+            stations=stations,
+            rename_dict=rename_dict,
+            save_dir=save_dir,
+            holidays=holidays)
+        return chunks, kwargs
+
+    def check_lease(self, url):
+        """
+        raise if the lease of url was taken over by another process,
+        which then processes url: nothing more of it is written here.
+        """
+        if self.leases is not None and not self.leases.holds(url.split('/')[-1]):
+            raise Exception(f'lease of {url} taken over by another process')
+
+    def close_source(self, url, files):
+        """
+        mark url complete in the manifest once all its chunks are written.
+        """
+        self.check_lease(url)
+        self.manifest.complete(url)
+        if not self.keep_archive:
+            for file_path in {file.zip_path for file in files if hasattr(file, 'zip_path')}:
+                os.remove(file_path)
+
+    def run_url(self, url, rename_dict, holidays, chunksize, scheduler=None):
         """
         process data from one url source.
+        chunks are sent to the pool of scheduler if provided.
         """
         #download/unzip data from the web
         downloads = self.download(url)
 
         if downloads is not None: # process only new files
             save_dir, files = downloads
+            chunks, kwargs = self.open_chunks(url, save_dir, files, rename_dict, holidays, chunksize)
+            if scheduler is None:
+                for save_name, trip_df in chunks:
+                    self.check_lease(url)
+                    paths = self.process(trip_df=trip_df, save_name=save_name, **kwargs)
+                    self.commit(url, save_name, paths)
+            else:
+                self.submit_chunks(scheduler, chunks, url, **kwargs)
+            self.close_source(url, files)
+
+    def run_pipeline(self, urls, rename_dict, holidays, chunksize, pool, failed, leases=None):
+        """
+        process urls in a pipeline of threads: download and unpack,
+        parse chunks, transform, write. every stage works on the next
+        items while the following stages work on the previous ones,
+        bounded queues cap the chunks held in memory. with a pool the
+        chunks are transformed and written by its workers.
+        a failing url is recorded in failed, the others go on.
+        the lease of a url in leases is released once it is processed.
+        """
+        def download(url):
+            try:
+                downloads = self.download(url)
+            except Exception as err:
+                logger.exception(f'failed: {url}')
+                failed[url] = err
+                return
+            if downloads is not None:
+                yield (url,) + downloads
+
+        def parse(item):
+            url, save_dir, files = item
+            try:
+                chunks, kwargs = self.open_chunks(url, save_dir, files, rename_dict, holidays, chunksize)
+                for save_name, trip_df in chunks:
+                    if url in failed:
+                        break
+                    yield 'chunk', url, save_name, trip_df, kwargs
+            except Exception as err:
+                logger.exception(f'failed: {url}')
+                failed[url] = err
+            yield 'end', url, files
+
+        def transform(item):
+            if item[0] == 'end':
+                yield item
+                return
+            if item[1] in failed:
+                # chunks of a failed url are dropped
+                return
+            _, url, save_name, trip_df, kwargs = item
+            try:
+                self.check_lease(url)
+                if pool is None:
+                    trip_df = self.transform(trip_df=trip_df, save_name=save_name, **kwargs)
+                    yield 'chunk', url, save_name, trip_df, kwargs['save_dir']
+                else:
+                    future = pool.submit(
+                        self.run_task,
+                        'process',
+                        trip_df=trip_df,
+                        save_name=save_name,
+                        **kwargs)
+                    yield 'future', url, save_name, future
+            except Exception as err:
+                logger.exception(f'failed: {url}: {save_name}')
+                failed[url] = err
+
+        def write(item):
+            url = item[1]
+            if item[0] == 'end':
+                if url not in failed:
+                    try:
+                        self.close_source(url, item[2])
+                    except Exception as err:
+                        logger.error(f'failed: {url}: {err!r}')
+                        failed[url] = err
+                if leases is not None:
+                    leases.release(url.split('/')[-1])
+                return
+            save_name = item[2]
+            try:
+                if item[0] == 'future':
+                    paths = self.task_result(item[3])
+                else:
+                    self.check_lease(url)
+                    paths = self.write(item[3], item[4], save_name)
+                self.check_lease(url)
+                self.commit(url, save_name, paths)
+            except Exception as err:
+                logger.error(f'{save_name}: {err!r}')
+                failed.setdefault(url, err)
+            # a generator with nothing to pass on
+            yield from ()
+
+        stages = [('download', download), ('parse', parse), ('transform', transform), ('write', write)]
+        Pipeline(stages, depth=PIPELINE_DEPTH).run(urls)
 
-            #load stations and trips data with pandas
-            trip_dfs, stations_df = self.load(files, chunksize)
-
-            #TODO: parallelize this loop
-            if chunksize:
-                for i, chunk_gen in enumerate(trip_dfs):
-                    with chunk_gen:
-                        j = 0
-                        for chunk in chunk_gen:
-                            self.process(
-                                stations_df=stations_df,
-                                trip_df=chunk,
-                                rename_dict=rename_dict,
-                                save_dir=save_dir,
-                                save_name=f'trip_{i}_{j}.csv',
-                                holidays=holidays)
-                            j += 1
+    def leased(self, url, leases, checked):
+        """
+        tell if this process holds the lease of url, leasing it on its
+        first check. urls leased by another process, or whose lease was
+        taken over since, are skipped.
+        """
+        name = url.split('/')[-1]
+        if url not in checked:
+            checked[url] = leases.acquire(name)
+            if not checked[url]:
+                logger.info(f'leased by another process, skipped: {url}')
+        elif checked[url]:
+            checked[url] = leases.holds(name)
+        return checked[url]
+
+    def prefetched(self, url_list, prefetcher, leases):
+        """
+        yield the urls of url_list in order, each once its file is
+        downloaded, and leased in leases.
+        downloads are scheduled max_per_host urls ahead of the consumer.
+        """
+        checked = {}
+        if prefetcher is None:
+            yield from (url for url in url_list if self.leased(url, leases, checked))
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        scheduled = set()
+        for k, url in enumerate(url_list):
+            for ahead in url_list[k:k + self.max_per_host + 1]:
+                if ahead in scheduled or not self.needs_download(ahead):
+                    continue
+                if self.leased(ahead, leases, checked):
+                    prefetcher.submit(ahead, self.source_paths(ahead)[0])
+                    scheduled.add(ahead)
+            if url in scheduled:
+                prefetcher.wait(url)
+            if self.leased(url, leases, checked):
+                yield url
+
+    def date_dimension(self, holidays):
+        """
+        build the date dimension of the run, for the requested years.
+        with the date_dim option it is also saved to data_dir and
+        reused by the next runs.
+        """
+        years = getattr(self, 'years_list', [])
+        path = os.path.join(self.data_dir, DATE_DIM_FILE)
+        if self.save_dates and os.path.exists(path):
+            return DateDimension.load(path, holidays, years)
+        dates = DateDimension(holidays, years)
+        if self.save_dates and dates.table is not None:
+            os.makedirs(self.data_dir, exist_ok=True)
+            dates.save(path)
+        return dates
+
+    def save_dimensions(self):
+        """
+        merge the station versions written so far into the station
+        dimension, save the date dimension extended to the trip dates.
+        """
+        merge_stations(self.data_dir)
+        dates = []
+        for entry in self.manifest.entries():
+            for stats in entry.get('stats', {}).values():
+                dates.extend(stats[key] for key in ['min_start_dt', 'max_start_dt'] if stats[key])
+        if dates:
+            # trips may end the day after the last start date
+            keys = date_keys(np.array([min(dates), max(dates)], dtype='datetime64[D]'))
+            self.dates.positions(keys + [0, 1])
+        if self.dates.table is not None:
+            self.dates.save(os.path.join(self.data_dir, DATE_DIM_FILE))
+
+    def run_urls(self, url_list, rename_dict, holidays, chunksize):
+        """
+        process all url sources, on a process pool if workers > 1.
+        urls are fanned out to the pool when there are enough of them
+        to keep every worker busy, otherwise urls go through a pipeline
+        overlapping download, parsing and processing, and chunks are
+        fanned out to the pool.
+        if max_per_host is set downloads are prefetched concurrently.
+        the pool and the prefetcher are those of self.scheduler when
+        it is set (shared by several operators), else they are created
+        for this run. memory_budget_mb is shared by all the chunks that
+        can be in flight at once.
+        a failing url is logged and does not stop the others.
+        with the compact option the chunk files of the complete sources
+        are then compacted by month, with the aggregates option their
+        station aggregates are merged, with the star_schema option the
+        station and date dimensions are saved.
+        only the urls of the shard option are processed. every url is
+        leased in data_dir/_leases while processed, so that processes
+        and hosts sharing data_dir never process the same url at once,
+        a url whose lease is taken over is given up before its next
+        write, and the files shared by all the urls are updated by one
+        process at a time.
+        a summary of the metrics is emitted at the end.
+        """
+        started = time.perf_counter()
+        failed = {}
+        url_list = self.shard_urls(url_list)
+        leases = Leases(os.path.join(self.data_dir, LEASE_DIR), self.lease_ttl)
+        self.leases = leases
+        preload('numpy', 'pandas', 'requests')
+        self.dates = self.date_dimension(holidays)
+        scheduler = self.scheduler
+        if scheduler is None:
+            scheduler = Scheduler(
+                workers=self.workers,
+                max_per_host=self.max_per_host,
+                retries=self.retries,
+                bandwidth=self.bandwidth)
+        self.throttle = scheduler.throttle
+
+        try:
+            urls = self.prefetched(url_list, scheduler.prefetcher, leases)
+            pool = scheduler if scheduler.executor is not None else None
+            if self.memory_budget:
+                # chunks held by the pipeline of each operator: one per
+                # stage (parse, transform, write) and queued ones
+                if pool is None:
+                    processes = 1
+                    in_flight = scheduler.operators * (3 + 2 * PIPELINE_DEPTH)
+                else:
+                    # two chunks per worker, the write stage only waits
+                    processes = scheduler.workers + 1
+                    in_flight = 2 * scheduler.workers + scheduler.operators * (2 + PIPELINE_DEPTH)
+                self.chunk_budget = chunk_budget(self.memory_budget, processes, in_flight)
+            if pool is not None and len(url_list) >= scheduler.workers:
+                pending = {}
+
+                def collect(futures):
+                    for future in futures:
+                        url = pending.pop(future)
+                        if future.exception() is not None:
+                            logger.error(f'failed: {url}: {future.exception()!r}')
+                            failed[url] = future.exception()
+                        else:
+                            self.task_result(future)
+                        leases.release(url.split('/')[-1])
+
+                for url in urls:
+                    if len(pending) >= scheduler.workers:
+                        collect(wait(pending, return_when=FIRST_COMPLETED)[0])
+                    future = scheduler.submit(
+                        self.run_task, 'run_url', url, rename_dict, holidays, chunksize)
+                    pending[future] = url
+                collect(wait(pending)[0])
             else:
-                for i, data in enumerate(trip_dfs):
-                    self.process(
-                        stations_df=stations_df,
-                        trip_df=data,
-                        rename_dict=rename_dict,
-                        save_dir=save_dir,
-                        save_name=f'trip_{i}.csv',
-                        holidays=holidays)
+                self.run_pipeline(urls, rename_dict, holidays, chunksize, pool, failed, leases)
+
+            if self.compaction or self.aggregation or self.star_schema:
+                if not leases.acquire(FINALIZE_LEASE, wait=self.lease_ttl):
+                    raise Exception(f'{FINALIZE_LEASE} lease of {self.data_dir} not released in {self.lease_ttl}s')
+            if self.compaction:
+                with self.metrics.stage('compact'):
+                    compact(self.data_dir, self.bike_sys)
+            if self.aggregation:
+                with self.metrics.stage('aggregate'):
+                    merge_aggregates(self.data_dir)
+            if self.star_schema:
+                with self.metrics.stage('dimensions'):
+                    self.save_dimensions()
+        finally:
+            leases.close()
+            self.leases = None
+            if scheduler is not self.scheduler:
+                scheduler.close()
+            self.metrics.summary(time.perf_counter() - started)
+
+        if failed:
+            msg = '{} of {} url(s) failed: {}'
+            raise Exception(msg.format(len(failed), len(url_list), ', '.join(failed)))
@@ -0,0 +1,153 @@
+"""
+Manifest of the sources processed in a data directory.
+Class: Manifest
+"""
+import os
+import json
+import threading
+
+
+class Manifest:
+    """
+    persistent record of the sources of a data_dir, one json file per
+    source under data_dir/_manifest. an entry holds the url, its remote
+    validators (etag, last_modified, size), a status ('processing' or
+    'complete'), the raw data files of the source, how they are cut in
+    chunks, the outputs committed for each chunk, the stats of
+    these files (start_dt range and station codes) and the station
+    aggregates of each chunk.
+    each source is only written by the process handling it, its
+    threads update entries under a lock.
+    """
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, '_manifest')
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def entry_path(self, url):
+        return os.path.join(self.path, url.split('/')[-1] + '.json')
+
+    def get(self, url):
+        """
+        return the entry of url, None if there is none.
+        """
+        path = self.entry_path(url)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def entries(self):
+        """
+        all the entries, sorted by file name.
+        """
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.json'):
+                with open(os.path.join(self.path, name), 'r') as file:
+                    entries.append(json.load(file))
+        return entries
+
+    def put(self, entry):
+        """
+        write an entry, atomically.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        path = self.entry_path(entry['url'])
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(entry, file, indent=1)
+        os.replace(tmp_path, path)
+
+    def start(self, url, remote, status='processing', files=None):
+        """
+        record a newly downloaded source and its raw data files,
+        relative to data_dir.
+        """
+        entry = {'url': url, 'remote': remote, 'status': status, 'outputs': {}}
+        if files is not None:
+            entry['files'] = files
+        self.put(entry)
+        return entry
+
+    def commit(self, url, save_name, files, stats=None, aggregates=None):
+        """
+        record the files written for chunk save_name of url,
+        stats maps some of them to their stats, aggregates are the
+        station aggregates files of the chunk.
+        """
+        with self.lock:
+            entry = self.get(url)
+            entry['outputs'][save_name] = files
+            if stats:
+                entry.setdefault('stats', {}).update(stats)
+            if aggregates:
+                entry.setdefault('aggregates', {})[save_name] = aggregates
+            self.put(entry)
+
+    def chunking(self, url, chunksize, sized):
+        """
+        chunk layout of url: the rows of the first chunk of every file
+        (None: whole files), if the next ones are sized from it and their
+        rows by file index. recorded by the first run, kept by the
+        resumed ones.
+        """
+        with self.lock:
+            entry = self.get(url)
+            if 'chunks' not in entry:
+                entry['chunks'] = {'chunk_size': chunksize, 'sized': sized, 'rows': {}}
+                self.put(entry)
+        layout = entry['chunks']
+        sizes = {int(index): rows for index, rows in layout['rows'].items()}
+        return layout['chunk_size'], layout['sized'], sizes
+
+    def chunk_rows(self, url, index, rows):
+        """
+        record the rows of the chunks of file index of url.
+        """
+        with self.lock:
+            entry = self.get(url)
+            entry['chunks']['rows'][str(index)] = rows
+            self.put(entry)
+
+    def committed(self, url):
+        """
+        names of the chunks of url already written.
+        """
+        entry = self.get(url)
+        if entry is None:
+            return set()
+        return set(entry['outputs'])
+
+    def complete(self, url):
+        """
+        mark url as fully processed.
+        """
+        with self.lock:
+            entry = self.get(url)
+            entry['status'] = 'complete'
+            self.put(entry)
+
+    @staticmethod
+    def changed(entry, remote):
+        """
+        tell if the remote validators differ from the recorded ones.
+        unknown validators are not considered a change.
+        """
+        if remote is None or entry.get('remote') is None:
+            return False
+        for key in ['etag', 'last_modified', 'size']:
+            old, new = entry['remote'].get(key), remote.get(key)
+            if old is not None and new is not None:
+                return old != new
+        return False
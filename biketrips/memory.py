@@ -0,0 +1,83 @@
+"""
+Chunk sizing from a memory budget.
+Class: ChunkSizer
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# memory of a chunk during process relative to the chunk read from csv:
+# the chunk itself, joined station attributes, datetime parts, holidays
+# and the write buffers. measured up to 5.5 on bixi (station names joined)
+EXPANSION = 6.0
+# resident memory of a process before any chunk is read
+PROCESS_MB = 150
+PROBE_ROWS = 10000
+MIN_CHUNK_ROWS = 1000
+
+
+def chunk_budget(budget_mb, processes, in_flight):
+    """
+    bytes available to every chunk in flight, out of budget_mb
+    shared by processes holding at most in_flight chunks.
+    """
+    available = (budget_mb - PROCESS_MB * processes) * 1024 * 1024
+    if available <= 0:
+        logger.warning(f'memory_budget_mb {budget_mb} too small for {processes} process(es)')
+        return 0
+    return available / in_flight
+
+
+class ChunkSizer:
+    """
+    number of rows of the chunks of a file, from the bytes per row of
+    its first chunk, so that a chunk expanded by process fits in budget
+    bytes. the budget depends on the workers and the operators of the
+    run, so the rows of every file are reported to on_size, and the
+    sizes already known by file index are reused: a resumed run cuts
+    the same chunks. without budget the chunks have max_rows rows.
+    """
+    def __init__(self, budget, max_rows=None, expansion=EXPANSION, sizes=None, on_size=None):
+        self.budget = budget
+        self.max_rows = max_rows
+        self.expansion = expansion
+        self.sizes = dict(sizes or {})
+        self.on_size = on_size
+
+    def rows(self, chunk):
+        """
+        rows per chunk given the first chunk of a file.
+        """
+        if self.budget is None:
+            return self.max_rows
+        bytes_per_row = chunk.memory_usage(index=False, deep=True).sum() / max(len(chunk), 1)
+        rows = int(self.budget / (bytes_per_row * self.expansion))
+        rows = max(rows, MIN_CHUNK_ROWS)
+        if self.max_rows:
+            rows = min(rows, self.max_rows)
+        logger.info(f'{bytes_per_row:.0f} bytes/row, chunks of {rows} rows')
+        return rows
+
+    def chunks(self, reader, index=0):
+        """
+        iterate a csv reader of file index: the first chunk of
+        reader.chunksize rows, then chunks sized from it.
+        """
+        try:
+            first = next(reader)
+        except StopIteration:
+            return
+        if index in self.sizes:
+            rows = self.sizes[index]
+        else:
+            # measured before the chunk is handed over and transformed
+            rows = self.rows(first) or reader.chunksize
+            if self.on_size is not None:
+                self.on_size(index, rows)
+        yield first
+        while True:
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+            yield chunk
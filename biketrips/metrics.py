@@ -0,0 +1,141 @@
+"""
+Per-stage metrics of a run: wall time, rows/s, bytes/s and peak RSS.
+Class: Metrics
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb():
+    """
+    peak resident set size of the current process in MB.
+    """
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def rate(value, seconds):
+    if not value or seconds <= 0:
+        return None
+    return round(value / seconds, 1)
+
+
+class Metrics:
+    """
+    time the stages of a run. every stage call gives one record,
+    written as a json line to sink:
+    - a file path: records are appended, pool workers share the file.
+    - 'log': records are logged by this module logger.
+    - None: records are not emitted, only the summary is logged.
+    totals per stage are kept for the end of run summary. copies sent
+    to pool workers start with empty totals, which are merged back with
+    the results of their tasks.
+    """
+    def __init__(self, sink=None, bike_sys=None):
+        self.sink = sink
+        self.bike_sys = bike_sys
+        self.totals = {}
+        self.peak_rss = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['totals'] = {}
+        state['peak_rss'] = None
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """
+        time the block as stage name. the yielded record can be updated,
+        rows and bytes give the throughput.
+        """
+        record = {'stage': name, 'bike_sys': self.bike_sys}
+        record.update(fields)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as err:
+            record['error'] = repr(err)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            record['seconds'] = round(seconds, 4)
+            record['rows_per_s'] = rate(record.get('rows'), seconds)
+            record['bytes_per_s'] = rate(record.get('bytes'), seconds)
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.add(name, seconds, record.get('rows'), record.get('bytes'), record['peak_rss_mb'])
+            self.emit(record)
+
+    def add(self, name, seconds, rows=None, nbytes=None, rss=None):
+        self.merge({name: {'calls': 1, 'seconds': seconds, 'rows': rows or 0, 'bytes': nbytes or 0}}, rss)
+
+    def merge(self, totals, rss=None):
+        """
+        add the totals recorded by another process.
+        """
+        with self.lock:
+            for name, other in totals.items():
+                own = self.totals.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+                for key in own:
+                    own[key] += other[key]
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def emit(self, record):
+        if self.sink is None:
+            return
+        record = dict(time=datetime.now().isoformat(timespec='milliseconds'), pid=os.getpid(), **record)
+        line = json.dumps(record, default=str)
+        if self.sink == 'log':
+            logger.info(line)
+        else:
+            with open(self.sink, 'a') as file:
+                file.write(line + '\n')
+
+    def summary(self, wall_seconds=None):
+        """
+        emit and log the totals of every stage, return them.
+        """
+        stages = {}
+        for name, totals in self.totals.items():
+            stages[name] = dict(
+                totals,
+                seconds=round(totals['seconds'], 4),
+                rows_per_s=rate(totals['rows'], totals['seconds']),
+                bytes_per_s=rate(totals['bytes'], totals['seconds']))
+        record = {
+            'stage': 'summary',
+            'bike_sys': self.bike_sys,
+            'wall_seconds': round(wall_seconds, 4) if wall_seconds is not None else None,
+            'peak_rss_mb': self.peak_rss,
+            'stages': stages,
+            }
+        self.emit(record)
+        for name, totals in stages.items():
+            logger.info('{}: {} call(s), {}s, {} rows, {} rows/s, {} bytes/s'.format(
+                name,
+                totals['calls'],
+                totals['seconds'],
+                totals['rows'],
+                totals['rows_per_s'],
+                totals['bytes_per_s']))
+        logger.info(f'wall time {record["wall_seconds"]}s, peak rss {self.peak_rss} MB')
+        return record
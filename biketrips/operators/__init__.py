@@ -1,6 +1,18 @@
-# load operators classes
+# operators classes, their modules are imported on first use
 
-from biketrips.operators.bixi import Bixi
-from biketrips.operators.bsto import Bsto
-from biketrips.operators.cabi import Cabi
-from biketrips.operators.citi import Citi
+import importlib
+
+OPERATOR_MODULES = {
+    'Bixi': 'bixi',
+    'Bsto': 'bsto',
+    'Cabi': 'cabi',
+    'Citi': 'citi',
+    }
+
+
+def __getattr__(name):
+    if name in OPERATOR_MODULES:
+        return getattr(importlib.import_module(f'{__name__}.{OPERATOR_MODULES[name]}'), name)
+    if name in OPERATOR_MODULES.values():
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
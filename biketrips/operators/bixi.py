@@ -3,14 +3,18 @@ A module containing tools to download and process trips historical data
 from bikesharing system Bixi
 """
 import logging
-import pandas as pd
-import holidays as hld
 
+from biketrips.lazy import lazy_import
+from biketrips.utils import read_csv
 from biketrips.utils import years_query
 from biketrips.utils import is_in_path
 from biketrips.utils import search_config
 from biketrips.loader import Trip
 from biketrips.loader import RENAME_DICT
+from biketrips.schema import read_options
+
+pd = lazy_import('pandas')
+hld = lazy_import('holidays')
 
 
 SEARCH_URL = 'https://bixi.com/en/open-data'
@@ -18,6 +22,11 @@ SEARCH_DICT = {"class": "document-csv col-md-2 col-sm-4 col-xs-12"}
 COUNTRY = 'CA'
 PROV = 'QC'
 STATE = None
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d %H:%M:%S.%f',
+    ]
 
 
 logger = logging.getLogger(__name__)
@@ -27,9 +36,12 @@ class Bixi(Trip):
     A class to download and process trips historical data
     from bikesharing system Bixi
     """
+    bike_sys = 'bixi'
+
     def __init__(self, args):
-        super(Bixi, self).__init__(args['data_dir'])
+        super(Bixi, self).__init__(args['data_dir'], args)
         self.rename_dict = RENAME_DICT
+        self.datetime_formats = DATETIME_FORMATS
         if 'chunk_size' in args:
             self.chunksize = args['chunk_size']
         else:
@@ -40,17 +52,19 @@ class Bixi(Trip):
             self.years_list = years_query('-')
 
     @staticmethod
-    def load(files, chunksize):
+    def load(files, chunksize, engine='pandas'):
         """
         download files from url then load as pandas df
         """
         station_files = [file for file in files if is_in_path(file, 'stations')]
         trip_files = [file for file in files if is_in_path(file, 'od_')]
 
-        trip_dfs = [pd.read_csv(file, chunksize=chunksize) for file in trip_files]
+        trip_dfs = [
+            read_csv(file, chunksize=chunksize, engine=engine, **read_options(Bixi.bike_sys, file))
+            for file in trip_files]
 
         stations_df = pd.concat(
-            [pd.read_csv(file) for file in station_files],
+            [read_csv(file, engine=engine, **read_options(Bixi.bike_sys, file)) for file in station_files],
             axis=0,
             ignore_index=True).drop_duplicates()
 
@@ -58,24 +72,19 @@ class Bixi(Trip):
         logger.info('trip files: {}'.format(trip_files))
         return trip_dfs, stations_df
 
-    def station_trip_join(self, stations_df, trip_df):
+    def find_urls(self):
         """
-        merge trip data and stations
+        list the urls of the trip files of the requested years.
         """
-        # merge stations and trips
-        merged_df = trip_df.merge(
-            stations_df,
-            how='left',
-            left_on='start_station_code',
-            right_on='code').drop('code', axis=1)
-
-        merged_df = merged_df.merge(
-            stations_df,
-            how='left',
-            left_on='end_station_code',
-            right_on='code',
-            suffixes=('', '_end')).drop('code', axis=1)
-        return merged_df
+        search_cfg = search_config(**SEARCH_DICT)
+        url_list = self.get_url_list(
+            url=SEARCH_URL,
+            search_cfg=search_cfg,
+            attr=None,
+            tag='href',
+            prefix='',
+            cache=self.listing_cache)
+        return self.href_filter(url_list, self.years_list)
 
     def run(self, url_list=None):
         """
@@ -89,21 +98,12 @@ class Bixi(Trip):
             prov=PROV,
             state=STATE)
 
-        search_cfg = search_config(**SEARCH_DICT)
-
         if url_list is None:
-            url_list = self.get_url_list(
-                url=SEARCH_URL,
-                search_cfg=search_cfg,
-                attr=None,
-                tag='href',
-                prefix='')
-            url_list = self.href_filter(url_list, self.years_list)
+            url_list = self.find_urls()
             
         logger.info('url_list: {}'.format(url_list))
-        for url in url_list:
-            self.run_url(
-                url=url,
-                rename_dict=self.rename_dict,
-                holidays=hdays,
-                chunksize=self.chunksize)
+        self.run_urls(
+            url_list=url_list,
+            rename_dict=self.rename_dict,
+            holidays=hdays,
+            chunksize=self.chunksize)
@@ -3,13 +3,16 @@ A module containing tools to download and process trips historical data
 from bike share Toronto
 """
 import logging
-import pandas as pd
-import holidays as hld
 
+from biketrips.lazy import lazy_import
+from biketrips.utils import read_csv
 from biketrips.utils import years_query
 from biketrips.utils import search_config
 from biketrips.loader import Trip
 from biketrips.loader import RENAME_DICT
+from biketrips.schema import read_options
+
+hld = lazy_import('holidays')
 
 
 SEARCH_URL = 'https://ckan0.cf.opendata.inter.prod-toronto.ca/tr/dataset/bike-share-toronto-ridership-data'
@@ -17,6 +20,13 @@ SEARCH_DICT = {"class": "resource-url-analytics"}
 COUNTRY = 'CA'
 PROV = 'ON'
 STATE = None
+DATETIME_FORMATS = [
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    ]
 
 
 logger = logging.getLogger(__name__)
@@ -26,9 +36,12 @@ class Bsto(Trip):
     A class to download and process trips historical data
     from bikesharing system Bixi
     """
+    bike_sys = 'bsto'
+
     def __init__(self, args):
-        super(Bsto, self).__init__(args['data_dir'])
+        super(Bsto, self).__init__(args['data_dir'], args)
         self.rename_dict = RENAME_DICT
+        self.datetime_formats = DATETIME_FORMATS
         if 'chunk_size' in args:
             self.chunksize = args['chunk_size']
         else:
@@ -39,15 +52,31 @@ class Bsto(Trip):
             self.years_list = years_query('-')
 
     @staticmethod
-    def load(files, chunksize):
+    def load(files, chunksize, engine='pandas'):
         """
         download files from url then load as pandas df
         """
         trip_files = files
-        trip_dfs = [pd.read_csv(file, chunksize=chunksize) for file in trip_files]
+        trip_dfs = [
+            read_csv(file, chunksize=chunksize, engine=engine, **read_options(Bsto.bike_sys, file))
+            for file in trip_files]
         logger.info('trip files: {}'.format(trip_files))
         return trip_dfs, None
 
+    def find_urls(self):
+        """
+        list the urls of the trip files of the requested years.
+        """
+        search_cfg = search_config(**SEARCH_DICT)
+        url_list = self.get_url_list(
+            url=SEARCH_URL,
+            search_cfg=search_cfg,
+            attr=None,
+            tag='href',
+            prefix='',
+            cache=self.listing_cache)
+        return self.href_filter(url_list, self.years_list)
+
     def run(self, url_list=None):
         """
         collect and save data
@@ -60,25 +89,12 @@ class Bsto(Trip):
             prov=PROV,
             state=STATE)
 
-        search_cfg = search_config(**SEARCH_DICT)
-        """
-        if url_list is None:
-            url_list = href_from_url(SEARCH_URL, search_cfg)
-            url_list = self.href_filter(url_list, self.years_list)
-        """
         if url_list is None:
-            url_list = self.get_url_list(
-                url=SEARCH_URL,
-                search_cfg=search_cfg,
-                attr=None,
-                tag='href',
-                prefix='')
-            url_list = self.href_filter(url_list, self.years_list)
+            url_list = self.find_urls()
             
         logger.info('url_list: {}'.format(url_list))
-        for url in url_list:
-            self.run_url(
-                url=url,
-                rename_dict=self.rename_dict,
-                holidays=hdays,
-                chunksize=self.chunksize)
+        self.run_urls(
+            url_list=url_list,
+            rename_dict=self.rename_dict,
+            holidays=hdays,
+            chunksize=self.chunksize)
@@ -3,20 +3,27 @@ A module containing tools to download and process trips data
 from citi bike New York
 """
 import logging
-import pandas as pd
-import holidays as hld
 
+from biketrips.lazy import lazy_import
+from biketrips.utils import read_csv
 from biketrips.utils import years_query
-from biketrips.utils import search_config
 from biketrips.loader import Trip
 from biketrips.loader import RENAME_DICT
+from biketrips.schema import read_options
+
+hld = lazy_import('holidays')
 
 
 SEARCH_URL = 'https://s3.amazonaws.com/tripdata'
-SEARCH_DICT = {"name": "key"}
 COUNTRY = 'US'
 PROV = None
 STATE = 'NY'
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    ]
 
 logger = logging.getLogger(__name__)
 
@@ -26,9 +33,12 @@ class Citi(Trip):
     A class to download and process trips historical data
     from bikesharing system Bixi
     """
+    bike_sys = 'citi'
+
     def __init__(self, args):
-        super(Citi, self).__init__(args['data_dir'])
+        super(Citi, self).__init__(args['data_dir'], args)
         self.rename_dict = RENAME_DICT
+        self.datetime_formats = DATETIME_FORMATS
         if 'chunk_size' in args:
             self.chunksize = args['chunk_size']
         else:
@@ -39,16 +49,28 @@ class Citi(Trip):
             self.years_list = years_query('-')
 
     @staticmethod
-    def load(files, chunksize):
+    def load(files, chunksize, engine='pandas'):
         """
         download files from url then load as pandas df
         """
         trip_files = [file for file in files if file.find('__MACOSX/') < 0]
         logger.info('trip files: {}'.format(trip_files))
-        trip_dfs = [pd.read_csv(file, chunksize=chunksize) for file in trip_files]
+        trip_dfs = [
+            read_csv(file, chunksize=chunksize, engine=engine, **read_options(Citi.bike_sys, file))
+            for file in trip_files]
         #logger.info('trip files: {}'.format(trip_files))
         return trip_dfs, None
 
+    def find_urls(self):
+        """
+        list the urls of the trip files of the requested years.
+        """
+        url_list = self.get_s3_url_list(
+            url=SEARCH_URL,
+            prefix=SEARCH_URL,
+            cache=self.listing_cache)
+        return self.href_filter(url_list, self.years_list)
+
     def run(self, url_list=None):
         """
         collect and save data
@@ -61,21 +83,12 @@ class Citi(Trip):
             prov=PROV,
             state=STATE)
 
-        search_cfg = search_config(**SEARCH_DICT)
-
         if url_list is None:
-            url_list = self.get_url_list(
-                url=SEARCH_URL,
-                search_cfg=search_cfg,
-                attr='text',
-                tag=None,
-                prefix=SEARCH_URL)
-            url_list = self.href_filter(url_list, self.years_list)
+            url_list = self.find_urls()
 
         logger.info('url_list: {}'.format(url_list))
-        for url in url_list:
-            self.run_url(
-                url=url,
-                rename_dict=self.rename_dict,
-                holidays=hdays,
-                chunksize=self.chunksize)
+        self.run_urls(
+            url_list=url_list,
+            rename_dict=self.rename_dict,
+            holidays=hdays,
+            chunksize=self.chunksize)
@@ -0,0 +1,91 @@
+"""
+Stages running concurrently in threads, connected by bounded queues.
+Class: Pipeline
+"""
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEPTH = 1
+_DONE = object()
+
+
+class Pipeline:
+    """
+    run stages in threads connected by queues of depth items.
+    a stage is a (name, func) pair, func takes an item and yields the
+    items of the next stage. a full queue blocks the stage feeding it,
+    which caps the items held in memory. stages handle the errors of
+    their items, any other error stops the pipeline and is raised by run.
+    """
+    def __init__(self, stages, depth=DEPTH):
+        self.stages = stages
+        self.depth = depth
+        self.abort = threading.Event()
+        self.error = None
+
+    def put(self, out_queue, item):
+        while not self.abort.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def items(self, in_queue):
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+    def work(self, name, func, items, out_queue, source=False):
+        try:
+            for item in items:
+                if self.abort.is_set():
+                    if source:
+                        break
+                    continue
+                for res in func(item):
+                    if out_queue is not None:
+                        self.put(out_queue, res)
+        except Exception as err:
+            logger.exception(f'pipeline stage {name} failed')
+            if self.error is None:
+                self.error = err
+            self.abort.set()
+            if not source:
+                # keep reading so that the previous stage is not blocked
+                for _ in items:
+                    pass
+        finally:
+            # the end marker is always delivered, the next stage reads
+            # its queue until it gets it
+            if out_queue is not None:
+                out_queue.put(_DONE)
+
+    def run(self, items):
+        """
+        feed items to the first stage, return once the last one is done.
+        """
+        threads = []
+        items = iter(items)
+        for k, (name, func) in enumerate(self.stages):
+            last = k == len(self.stages) - 1
+            out_queue = None if last else queue.Queue(maxsize=self.depth)
+            thread = threading.Thread(
+                target=self.work,
+                args=(name, func, items, out_queue, k == 0),
+                name=name,
+                daemon=True)
+            threads.append(thread)
+            if out_queue is not None:
+                items = self.items(out_queue)
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,206 @@
+"""
+Read back of the processed trips of a data directory.
+Function: scan
+"""
+import os
+import json
+import logging
+
+from biketrips.compact import INDEX_FILE
+from biketrips.compact import MONTHLY_DIR
+from biketrips.compact import parquet_month
+from biketrips.compact import signature
+from biketrips.compact import source_fragments
+from biketrips.lazy import lazy_import
+from biketrips.manifest import Manifest
+from biketrips.star import KEY_COLUMNS
+from biketrips.star import station_key_set
+from biketrips.writer import PARTITION_COLUMNS
+from biketrips.writer import STATION_COLUMNS
+from biketrips.writer import STATION_KEY_COLUMNS
+from biketrips.writer import station_codes
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 100000
+
+
+def month_files(data_dir, fragments, stats):
+    """
+    month files of the compaction of data_dir with their stats and the
+    chunk files they hold. none if the compaction is missing or older
+    than one of its chunk files, the chunk files are read instead.
+    """
+    index_path = os.path.join(data_dir, MONTHLY_DIR, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return [], set()
+    with open(index_path, 'r') as file:
+        index = json.load(file)
+    for path, old in index['fragments'].items():
+        full_path = os.path.join(data_dir, path)
+        if path not in fragments or not os.path.exists(full_path):
+            logger.info(f'{MONTHLY_DIR} outdated, {path} is gone')
+            return [], set()
+        sig = signature(full_path)
+        if old['size'] != sig['size'] or old['mtime_ns'] != sig['mtime_ns']:
+            logger.info(f'{MONTHLY_DIR} outdated, {path} changed')
+            return [], set()
+
+    files = []
+    covered = set()
+    for name, info in sorted(index['files'].items()):
+        covered.update(info['fragments'])
+        month_stats = {
+            'min_start_dt': info['min_start_dt'] and info['min_start_dt'][:10],
+            'max_start_dt': info['max_start_dt'] and info['max_start_dt'][:10],
+            }
+        for field in ['stations', 'station_keys']:
+            values = set()
+            for path in info['fragments']:
+                if stats.get(path, {}).get(field) is None:
+                    values = None
+                    break
+                values.update(stats[path][field])
+            month_stats[field] = None if values is None else sorted(values)
+        files.append((os.path.join(MONTHLY_DIR, name), month_stats))
+    return files, covered
+
+def data_files(data_dir):
+    """
+    files holding the trips of data_dir with their stats, None when
+    unknown: the month files of the compaction and the chunk files of
+    the complete sources they do not hold.
+    """
+    stats = {}
+    for entry in Manifest(data_dir).entries():
+        stats.update(entry.get('stats', {}))
+    fragments = source_fragments(data_dir)
+    files, covered = month_files(data_dir, fragments, stats)
+    files.extend((path, stats.get(path)) for path in fragments if path not in covered)
+    return files
+
+def keep_file(stats, start, end, stations, keys):
+    """
+    tell if a file may hold rows of the query, from its stats.
+    keys are the station keys of stations for star schema files.
+    """
+    if stats is None:
+        return True
+    if start is not None and stats['max_start_dt'] is not None and stats['max_start_dt'] < start:
+        return False
+    if end is not None and stats['min_start_dt'] is not None and stats['min_start_dt'] > end:
+        return False
+    if stations is not None and stats['stations'] is not None:
+        return not stations.isdisjoint(stats['stations'])
+    if keys is not None and stats.get('station_keys') is not None:
+        return not keys.isdisjoint(stats['station_keys'])
+    return True
+
+def read_csv(path, columns, chunksize):
+    """
+    chunks of the columns of a csv file, None is every column.
+    keys are read as nullable integers, floats would round them.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = None if columns is None else [column for column in header if column in columns]
+    dtype = {column: 'Int64' for column in header if column in KEY_COLUMNS}
+    with pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+def read_parquet(path, columns, chunksize):
+    """
+    chunks of the columns of a parquet file, None is every column.
+    partition columns of chunk files are rebuilt from their folders.
+    """
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    names = parquet.schema_arrow.names
+    usecols = None if columns is None else [column for column in names if column in columns]
+    partition = {}
+    for column in PARTITION_COLUMNS:
+        if column not in names and (columns is None or column in columns):
+            partition[column] = column
+    if partition:
+        key = parquet_month(path)
+        values = key.split('-') if '-' in key else [None, None]
+        partition = {column: values[k] for k, column in enumerate(PARTITION_COLUMNS) if column in partition}
+    for batch in parquet.iter_batches(batch_size=chunksize, columns=usecols):
+        chunk = batch.to_pandas()
+        for column, value in partition.items():
+            chunk[column] = pd.Series(
+                [None if value is None else int(value)] * len(chunk), dtype='Int64')
+        yield chunk
+
+def row_mask(chunk, start, end, stations, keys):
+    """
+    rows of chunk matching the query.
+    """
+    mask = pd.Series(True, index=chunk.index)
+    if start is not None or end is not None:
+        if 'start_dt' in chunk:
+            dates = pd.to_datetime(chunk['start_dt'], errors='coerce')
+        else:
+            dates = pd.to_datetime(chunk['start_date_key'], unit='D')
+        dates = dates.dt.strftime('%Y-%m-%d')
+        if start is not None:
+            mask &= dates >= start
+        if end is not None:
+            mask &= dates <= end
+    if stations is not None:
+        matched = pd.Series(False, index=chunk.index)
+        for column in STATION_COLUMNS:
+            if column in chunk:
+                matched |= station_codes(chunk[column]).isin(stations).to_numpy()
+        for column in STATION_KEY_COLUMNS:
+            if column in chunk:
+                matched |= chunk[column].isin(keys).to_numpy()
+        mask &= matched
+    return mask
+
+def scan(bike_sys, start=None, end=None, stations=None, columns=None, data_dir='.', chunksize=CHUNK_ROWS):
+    """
+    iterate the processed trips of bike_sys in data_dir/bike_sys as
+    dataframes of at most chunksize rows.
+    only the trips with start_dt between start and end (dates, both
+    included) and starting or ending at one of stations are yielded,
+    with columns only if given.
+    files are skipped from the start_dt range and station codes recorded
+    in the manifest when written, only the needed columns are read.
+    star schema trips are yielded with their keys, see denormalize.
+    """
+    root = os.path.join(data_dir, bike_sys)
+    start = None if start is None else pd.Timestamp(start).strftime('%Y-%m-%d')
+    end = None if end is None else pd.Timestamp(end).strftime('%Y-%m-%d')
+    keys = None
+    if stations is not None:
+        stations = set(station_codes(list(stations)))
+        keys = station_key_set(root, stations)
+    read_columns = None
+    if columns is not None:
+        columns = list(columns)
+        read_columns = set(columns)
+        if start is not None or end is not None:
+            read_columns.update(['start_dt', 'start_date_key'])
+        if stations is not None:
+            read_columns.update(STATION_COLUMNS + STATION_KEY_COLUMNS)
+
+    files = data_files(root)
+    kept = [path for path, stats in files if keep_file(stats, start, end, stations, keys)]
+    logger.info(f'{bike_sys}: {len(kept)} of {len(files)} file(s) to read')
+    for path in kept:
+        full_path = os.path.join(root, path)
+        if path.endswith('.parquet'):
+            chunks = read_parquet(full_path, read_columns, chunksize)
+        else:
+            chunks = read_csv(full_path, read_columns, chunksize)
+        for chunk in chunks:
+            if start is not None or end is not None or stations is not None:
+                chunk = chunk[row_mask(chunk, start, end, stations, keys)]
+            if columns is not None:
+                chunk = chunk.reindex(columns=columns)
+            if len(chunk):
+                yield chunk.reset_index(drop=True)
@@ -0,0 +1,71 @@
+"""
+Process pool and download prefetcher shared by the operators of a run.
+Class: Scheduler
+"""
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from biketrips.fetch import Prefetcher
+from biketrips.fetch import RETRIES
+from biketrips.fetch import Throttle
+from biketrips.utils import init_worker
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    a process pool of workers processes and a prefetcher keeping at most
+    max_per_host downloads in flight per host. the throttle of bandwidth
+    bytes/s is shared by the prefetched and the direct downloads.
+    at most two tasks per worker are in flight, whichever operator
+    submits them, so that operators running concurrently share one
+    worker and memory budget. operators is the number of operators
+    sharing the scheduler.
+    """
+    def __init__(self, workers=None, max_per_host=None, retries=RETRIES, bandwidth=None, operators=1):
+        self.workers = workers
+        self.operators = operators
+        self.executor = None
+        self.prefetcher = None
+        self.slots = None
+        self.throttle = Throttle(bandwidth) if bandwidth else None
+        if workers and workers > 1:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(logging.getLogger().level,))
+            # start the workers before any prefetch thread exists
+            self.executor.submit(int).result()
+            self.slots = threading.BoundedSemaphore(2 * workers)
+        if max_per_host:
+            self.prefetcher = Prefetcher(
+                max_per_host=max_per_host,
+                retries=retries,
+                throttle=self.throttle)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        submit a task to the pool once an in-flight slot is free.
+        """
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def close(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,160 @@
+"""
+Schema registry: read_csv options of raw files per operator
+and header signature.
+"""
+from functools import lru_cache
+
+from biketrips.utils import format_column_name
+from biketrips.utils import read_csv
+
+# per operator, layouts tried in order. a layout applies when all its
+# 'match' columns are in the header, dtypes are keyed by standardized
+# column name and only set for the columns present.
+SCHEMAS = {
+    'bixi': [
+        {
+            'match': [],
+            'dtype': {
+                'start_station_code': 'Int32',
+                'end_station_code': 'Int32',
+                'emplacement_pk_start': 'Int32',
+                'emplacement_pk_end': 'Int32',
+                'duration_sec': 'Int32',
+                'is_member': 'Int8',
+                'code': 'Int32',
+                'pk': 'Int32',
+                'name': 'category',
+                'latitude': 'float64',
+                'longitude': 'float64',
+                },
+            },
+        ],
+    'bsto': [
+        {
+            'match': [],
+            'dtype': {
+                'trip_id': 'Int64',
+                'subscription_id': 'Int64',
+                'trip_duration_seconds': 'Int32',
+                'trip__duration': 'Int32',
+                'from_station_id': 'Int32',
+                'to_station_id': 'Int32',
+                'start_station_id': 'Int32',
+                'end_station_id': 'Int32',
+                'from_station_name': 'category',
+                'to_station_name': 'category',
+                'start_station_name': 'category',
+                'end_station_name': 'category',
+                'user_type': 'category',
+                },
+            },
+        ],
+    'cabi': [
+        {
+            # since 2020: alphanumeric station ids
+            'match': ['ride_id'],
+            'dtype': {
+                'rideable_type': 'category',
+                'start_station_name': 'category',
+                'start_station_id': 'category',
+                'end_station_name': 'category',
+                'end_station_id': 'category',
+                'start_lat': 'float64',
+                'start_lng': 'float64',
+                'end_lat': 'float64',
+                'end_lng': 'float64',
+                'member_casual': 'category',
+                },
+            },
+        {
+            'match': [],
+            'dtype': {
+                'duration': 'Int32',
+                'start_station_number': 'Int32',
+                'start_station': 'category',
+                'end_station_number': 'Int32',
+                'end_station': 'category',
+                'bike_number': 'category',
+                'member_type': 'category',
+                },
+            },
+        ],
+    'citi': [
+        {
+            # since 2021: alphanumeric station ids
+            'match': ['ride_id'],
+            'dtype': {
+                'rideable_type': 'category',
+                'start_station_name': 'category',
+                'start_station_id': 'category',
+                'end_station_name': 'category',
+                'end_station_id': 'category',
+                'start_lat': 'float64',
+                'start_lng': 'float64',
+                'end_lat': 'float64',
+                'end_lng': 'float64',
+                'member_casual': 'category',
+                },
+            },
+        {
+            'match': [],
+            'dtype': {
+                'tripduration': 'Int32',
+                'trip_duration': 'Int32',
+                'start_station_id': 'Int32',
+                'start_station_name': 'category',
+                'start_station_latitude': 'float64',
+                'start_station_longitude': 'float64',
+                'end_station_id': 'Int32',
+                'end_station_name': 'category',
+                'end_station_latitude': 'float64',
+                'end_station_longitude': 'float64',
+                'bikeid': 'Int32',
+                'bike_id': 'Int32',
+                'usertype': 'category',
+                'user_type': 'category',
+                'gender': 'Int8',
+                },
+            'na_values': ['\\N'],
+            },
+        ],
+    }
+
+
+def read_header(file):
+    """
+    return the column names of a csv file.
+    """
+    return tuple(read_csv(file, nrows=0).columns)
+
+@lru_cache(maxsize=None)
+def schema_options(bike_sys, header):
+    """
+    read_csv options for a header of bike_sys files:
+    compact dtypes, and usecols skipping unnamed (empty) columns.
+    """
+    names = [format_column_name(column) for column in header]
+    layout = {'match': [], 'dtype': {}}
+    for candidate in SCHEMAS.get(bike_sys, []):
+        if all(name in names for name in candidate['match']):
+            layout = candidate
+            break
+
+    usecols = [raw for raw in header if not raw.startswith('Unnamed:')]
+    options = {
+        'dtype': {
+            raw: layout['dtype'][name]
+            for raw, name in zip(header, names)
+            if name in layout['dtype'] and raw in usecols},
+        'usecols': usecols,
+        }
+    if 'na_values' in layout:
+        options['na_values'] = layout['na_values']
+    return options
+
+def read_options(bike_sys, file):
+    """
+    read_csv options for a raw file of bike_sys.
+    the header is read once per file.
+    """
+    return dict(schema_options(bike_sys, read_header(file)))
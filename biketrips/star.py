@@ -0,0 +1,277 @@
+"""
+Star schema output: trips hold integer keys to a station and a date dimension.
+Functions: normalize, write_versions, merge_stations, denormalize
+"""
+import os
+import json
+import glob
+import logging
+
+from biketrips.dates import HOLIDAY_COLUMNS
+from biketrips.dates import date_keys
+from biketrips.lazy import lazy_import
+from biketrips.writer import station_codes
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+STATION_DIM_FILE = 'station_dim.csv'
+DATE_DIM_FILE = 'date_dim.csv'
+# flat trip columns of every source, restored by denormalize
+COLUMNS_FILE = 'station_columns.json'
+VERSIONS_DIR = '_station_dim'
+MERGED_FILE = '_merged.json'
+STATION_ATTRIBUTES = ['name', 'latitude', 'longitude']
+# code column and attribute columns of the stations of a trip, by side.
+# attributes are joined from the station table (bixi: name_end...) or
+# come with the trips (end_name, citi: end_station_latitude..., citi and
+# cabi since 2020: end_lat...)
+STATION_SIDES = {
+    'start': ('start_station_code', {
+        'name': 'name',
+        'latitude': 'latitude',
+        'longitude': 'longitude',
+        'start_station_latitude': 'latitude',
+        'start_station_longitude': 'longitude',
+        'start_lat': 'latitude',
+        'start_lng': 'longitude'}),
+    'end': ('end_station_code', {
+        'name_end': 'name',
+        'end_name': 'name',
+        'latitude_end': 'latitude',
+        'longitude_end': 'longitude',
+        'end_station_latitude': 'latitude',
+        'end_station_longitude': 'longitude',
+        'end_lat': 'latitude',
+        'end_lng': 'longitude'}),
+    }
+DATE_PARTS = ['dt', 'year', 'month', 'day', 'day_of_week']
+KEY_COLUMNS = ['start_station_key', 'end_station_key', 'start_date_key', 'end_date_key']
+
+
+def station_keys(codes, attributes):
+    """
+    key of every station version, a code with its attributes: a 63 bits
+    hash of their values as strings. every process gives the same key
+    to the same version without any coordination.
+    """
+    values = pd.DataFrame({'code': station_codes(codes).to_numpy()})
+    for name in STATION_ATTRIBUTES:
+        if name in attributes:
+            values[name] = attributes[name].astype(str).to_numpy()
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    keys = pd.array((hashes >> np.uint64(1)).astype(np.int64), dtype='Int64')
+    keys[np.asarray(pd.isna(codes))] = pd.NA
+    return keys
+
+def normalize(trip_df, keep=()):
+    """
+    replace the station codes and attributes of trip_df by station keys,
+    and its date columns and holidays by date keys, except the columns
+    in keep. return the new trip_df and the station versions it refers to.
+    """
+    keys = {}
+    versions = []
+    dropped = list(HOLIDAY_COLUMNS)
+    for side, (code_column, columns) in STATION_SIDES.items():
+        if code_column not in trip_df:
+            continue
+        present = {column: name for column, name in columns.items() if column in trip_df}
+        attributes = pd.DataFrame({name: trip_df[column] for column, name in present.items()})
+        keys[f'{side}_station_key'] = station_keys(trip_df[code_column], attributes)
+        version = attributes.assign(code=trip_df[code_column], station_key=keys[f'{side}_station_key'])
+        versions.append(version.dropna(subset=['station_key']).drop_duplicates('station_key'))
+        dropped.extend([code_column] + list(present))
+    for side in ['start', 'end']:
+        if f'{side}_dt' in trip_df:
+            date_key = date_keys(trip_df[f'{side}_dt'])
+            keys[f'{side}_date_key'] = pd.array(
+                np.where(date_key == np.iinfo(np.int64).min, None, date_key), dtype='Int64')
+            dropped.extend(f'{side}_{part}' for part in DATE_PARTS)
+
+    dropped = [column for column in dropped if column in trip_df and column not in keep]
+    keys = pd.DataFrame(keys, index=trip_df.index)
+    trip_df = pd.concat([keys, trip_df.drop(dropped, axis=1)], axis=1)
+    if versions:
+        versions = pd.concat(versions).drop_duplicates('station_key')
+        versions = versions[['station_key', 'code'] + [name for name in STATION_ATTRIBUTES if name in versions]]
+    else:
+        versions = None
+    return trip_df, versions
+
+def station_columns(trip_df, columns=None):
+    """
+    layout of the flat trips of trip_df written with columns (all by
+    default): the columns in order and the station attribute column of
+    every side and attribute, e.g. {'end': {'name': 'end_name'}}.
+    """
+    columns = list(trip_df.columns if columns is None else columns)
+    stations = {}
+    for side, (_, attributes) in STATION_SIDES.items():
+        stations[side] = {name: column for column, name in attributes.items() if column in columns}
+    return {'columns': columns, 'stations': stations}
+
+def write_versions(versions, data_dir, source, save_name, layout=None):
+    """
+    write the station versions of a chunk to data_dir/_station_dim,
+    with the layout of the flat trips of its source if given.
+    """
+    out_dir = os.path.join(data_dir, VERSIONS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f'{source}_{save_name}')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    versions.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    if layout is not None:
+        layout_path = os.path.join(out_dir, f'{source}.columns.json')
+        tmp_path = f'{layout_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(layout, file, indent=1)
+        os.replace(tmp_path, layout_path)
+    return path
+
+def merge_stations(data_dir):
+    """
+    add the station versions written since the last merge to
+    data_dir/station_dim.csv. a version gets the source it was first
+    seen in and a number, counted by code in the order they are merged.
+    the flat trip layouts of the sources are gathered in
+    data_dir/station_columns.json.
+    """
+    out_dir = os.path.join(data_dir, VERSIONS_DIR)
+    path = os.path.join(data_dir, STATION_DIM_FILE)
+    merged_path = os.path.join(out_dir, MERGED_FILE)
+    merged = []
+    if os.path.exists(path) and os.path.exists(merged_path):
+        with open(merged_path, 'r') as file:
+            merged = json.load(file)
+    layouts = {}
+    for layout_path in sorted(glob.glob(os.path.join(out_dir, '*.columns.json'))):
+        with open(layout_path, 'r') as file:
+            layouts[os.path.basename(layout_path)[:-len('.columns.json')]] = json.load(file)
+    if layouts:
+        columns_path = os.path.join(data_dir, COLUMNS_FILE)
+        tmp_path = f'{columns_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(layouts, file, indent=1)
+        os.replace(tmp_path, columns_path)
+
+    pieces = sorted(glob.glob(os.path.join(out_dir, '*.csv')))
+    new = [piece for piece in pieces if os.path.basename(piece) not in merged]
+    if not new:
+        return
+
+    tables = [read_stations(path)] if merged else []
+    for piece in new:
+        table = read_stations(piece)
+        table['source'] = os.path.basename(piece).split('_trip_')[0]
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True).drop_duplicates('station_key')
+    # versions already numbered keep their number
+    unnumbered = table['version'].isna()
+    offset = table.groupby('code')['version'].transform('max').fillna(0)
+    table.loc[unnumbered, 'version'] = offset[unnumbered] + table[unnumbered].groupby('code').cumcount() + 1
+    table['version'] = table['version'].astype('int64')
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    table.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    tmp_path = f'{merged_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(merged + [os.path.basename(piece) for piece in new], file, indent=1)
+    os.replace(tmp_path, merged_path)
+    logger.info(f'{len(new)} station version file(s) merged, {len(table)} station versions')
+
+def read_stations(path):
+    table = pd.read_csv(path, dtype={'code': str})
+    if 'version' not in table:
+        table['version'] = np.nan
+    return table
+
+_dimensions = {}
+
+def read_dimension(path, key, **kwargs):
+    """
+    dimension table of path indexed by key, cached until the file changes.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if path not in _dimensions or _dimensions[path][0] != mtime:
+        _dimensions[path] = (mtime, pd.read_csv(path, **kwargs).set_index(key))
+    return _dimensions[path][1]
+
+def station_key_set(data_dir, codes):
+    """
+    keys of every version of the station codes.
+    """
+    path = os.path.join(data_dir, STATION_DIM_FILE)
+    if not os.path.exists(path):
+        return set()
+    stations = read_dimension(path, 'station_key', dtype={'code': str})
+    return set(stations.index[station_codes(stations['code']).isin(codes).to_numpy()])
+
+def take(table, keys):
+    """
+    rows of table for keys, missing values for unknown keys.
+    """
+    positions = table.index.get_indexer(pd.array(keys, dtype='Int64').fillna(-1))
+    return {
+        column: pd.api.extensions.take(table[column].array, positions, allow_fill=True)
+        for column in table.columns}
+
+def trip_layout(data_dir, source=None):
+    """
+    layout of the flat trips of source recorded in data_dir, see
+    station_columns. without source, the layout shared by all the
+    sources, else the one of the last source. None if not recorded.
+    """
+    path = os.path.join(data_dir, COLUMNS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        layouts = json.load(file)
+    if source is not None:
+        return layouts.get(source)
+    if len({json.dumps(layout, sort_keys=True) for layout in layouts.values()}) > 1:
+        logger.warning(f'sources of {data_dir} have different columns, pass the source of the trips to denormalize')
+    return layouts[max(layouts)] if layouts else None
+
+def denormalize(trip_df, data_dir, source=None):
+    """
+    flat trips from star schema trips of data_dir: station codes and
+    attributes, date parts and holidays in place of the keys.
+    station attributes and column order are those of the flat trips
+    of source (a folder of data_dir) when recorded.
+    """
+    trip_df = trip_df.copy()
+    layout = trip_layout(data_dir, source)
+    station_path = os.path.join(data_dir, STATION_DIM_FILE)
+    if any(f'{side}_station_key' in trip_df for side in STATION_SIDES):
+        stations = read_dimension(station_path, 'station_key')
+        stations = stations[['code'] + [name for name in STATION_ATTRIBUTES if name in stations]]
+        for side, suffix in [('start', ''), ('end', '_end')]:
+            if f'{side}_station_key' not in trip_df:
+                continue
+            values = take(stations, trip_df.pop(f'{side}_station_key'))
+            trip_df[f'{side}_station_code'] = values.pop('code')
+            for name, value in values.items():
+                if layout is None:
+                    trip_df[name + suffix] = value
+                elif name in layout['stations'][side]:
+                    trip_df[layout['stations'][side][name]] = value
+    if any(f'{side}_date_key' in trip_df for side in ['start', 'end']):
+        dates = read_dimension(os.path.join(data_dir, DATE_DIM_FILE), 'date_key', parse_dates=['dt'])
+        for side in ['start', 'end']:
+            if f'{side}_date_key' not in trip_df:
+                continue
+            values = take(dates, trip_df.pop(f'{side}_date_key'))
+            for part in DATE_PARTS:
+                trip_df[f'{side}_{part}'] = values[part]
+            if side == 'start':
+                for column in HOLIDAY_COLUMNS:
+                    trip_df[column] = values[column]
+    if layout is not None:
+        columns = [column for column in layout['columns'] if column in trip_df]
+        trip_df = trip_df[columns + [column for column in trip_df if column not in columns]]
+    return trip_df
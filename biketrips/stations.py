@@ -0,0 +1,46 @@
+"""
+Station lookup used to enrich trips.
+Class: StationIndex
+"""
+from biketrips.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+
+class StationIndex:
+    """
+    station table indexed by code, built once per archive.
+    trips get the station attributes with a vectorized take on the row
+    position of their station code, without merging the trip chunk.
+    """
+    def __init__(self, stations_df):
+        # one row per code, a merge would duplicate trips otherwise
+        stations_df = stations_df.drop_duplicates('code', keep='last')
+        self.index = pd.Index(stations_df['code'])
+        self.table = stations_df.drop('code', axis=1).reset_index(drop=True)
+
+    @property
+    def columns(self):
+        return list(self.table.columns)
+
+    def positions(self, codes):
+        """
+        row positions of station codes, -1 for unknown codes.
+        """
+        return self.index.get_indexer(codes)
+
+    def enrich(self, trip_df, code_column, suffix='', columns=None):
+        """
+        add the attributes of the station in code_column to trip_df,
+        named with suffix, only those in columns if given.
+        unknown stations get missing values.
+        """
+        if columns is None:
+            columns = self.table.columns
+        positions = self.positions(trip_df[code_column])
+        for column in columns:
+            trip_df[column + suffix] = pd.api.extensions.take(
+                self.table[column].array,
+                positions,
+                allow_fill=True)
+        return trip_df
@@ -3,14 +3,56 @@ Various utility functions used by main modules.
 """
 import os
 import re
+import logging
+from zipfile import ZipFile
+from datetime import date
 from datetime import timedelta
 from datetime import datetime
 
-import pandas as pd
-import numpy as np
-import requests
-from bs4 import BeautifulSoup
+from biketrips.arrow_csv import OPTIONS as ARROW_OPTIONS
+from biketrips.arrow_csv import read_csv as read_arrow_csv
+from biketrips.discovery import fetch_page
+from biketrips.fetch import get_text
+from biketrips.lazy import lazy_import
 
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+bs4 = lazy_import('bs4')
+
+LOG_FMT = '%(asctime)s %(levelname)s %(processName)s %(name)s %(funcName)s : %(message)s'
+LOG_DATEFMT = '%y/%m/%d %H:%M:%S'
+
+
+class ZipMember(str):
+    """
+    path of a file stored in a zip archive, '{zip_path}/{member}'.
+    it behaves as a string for filters on file names.
+    """
+    def __new__(cls, zip_path, member):
+        path = super().__new__(cls, os.path.join(zip_path, member))
+        path.zip_path = zip_path
+        path.member = member
+        return path
+
+    def __getnewargs__(self):
+        return self.zip_path, self.member
+
+    def open(self):
+        """
+        return a binary file object streaming the member.
+        the archive is closed with it: the file of a closed ZipFile
+        stays open until its last member stream is closed.
+        """
+        with ZipFile(self.zip_path, 'r') as zip_file:
+            return zip_file.open(self.member)
+
+
+def init_worker(level):
+    """
+    configure logging in a pool worker process.
+    no-op when the worker inherited the parent configuration.
+    """
+    logging.basicConfig(level=level, format=LOG_FMT, datefmt=LOG_DATEFMT)
 
 def walk_dir(directory):
     """
@@ -22,6 +64,53 @@ def walk_dir(directory):
             files_list.append(os.path.join(path, file))
     return files_list
 
+def zip_members(zip_path):
+    """
+    list the files of a zip archive as ZipMember paths.
+    directories and __MACOSX/ resource forks are skipped.
+    """
+    with ZipFile(zip_path, 'r') as zip_file:
+        names = zip_file.namelist()
+    return [
+        ZipMember(zip_path, name) for name in names
+        if not name.endswith('/') and name.find('__MACOSX/') < 0]
+
+def closing_reader(reader, stream):
+    """
+    close stream with the chunk reader of pandas read_csv reading it,
+    pandas only closes the files it opened.
+    """
+    close = reader.close
+
+    def close_all():
+        close()
+        stream.close()
+
+    reader.close = close_all
+    return reader
+
+def read_csv(file, engine='pandas', **kwargs):
+    """
+    pandas read_csv on a file path or a ZipMember.
+    zip members are streamed from the archive, never extracted, and
+    closed once read, or with the reader of their chunks.
+    with engine pyarrow the file is parsed on several threads.
+    """
+    if engine == 'pyarrow' and all(option in ARROW_OPTIONS for option in kwargs):
+        return read_arrow_csv(file, **kwargs)
+    if isinstance(file, ZipMember):
+        stream = file.open()
+        try:
+            data = pd.read_csv(stream, **kwargs)
+        except Exception:
+            stream.close()
+            raise
+        if kwargs.get('chunksize') or kwargs.get('iterator'):
+            return closing_reader(data, stream)
+        stream.close()
+        return data
+    return pd.read_csv(file, **kwargs)
+
 def dist_to_holiday(date, holidays, direction='next'):
     """
     find the next holiday and current delta between date and holiday.
@@ -36,27 +125,132 @@ def dist_to_holiday(date, holidays, direction='next'):
             break
     return delta, day
 
+def holiday_dates(holidays, years):
+    """
+    materialize the holidays of the given years.
+    return sorted datetime64 dates and the matching holiday names.
+    """
+    for year in years:
+        # requesting a date populates its whole year
+        _ = date(year, 1, 1) in holidays
+    days = sorted(day for day in holidays if day.year in years)
+    dates = np.array(days, dtype='datetime64[D]')
+    names = np.array([holidays.get(day) for day in days] + [None], dtype=object)
+    return dates, names
+
 def get_calendar_holidays(dt_series, holidays):
     """
     given an input date series and holidays object,
     return a dataframe with next and previous holidays type and delay to/from
+    holidays are looked up 365 days ahead and behind at most, as
+    dist_to_holiday does, with a binary search in the sorted holiday dates.
     """
     calendar = pd.DataFrame(dt_series, columns=['dt']).sort_values('dt')
-    def func(direction):
-        def myfunc(date):
-            return dist_to_holiday(
-                date,
-                holidays=holidays,
-                direction=direction)
-        return myfunc
-    next_h = np.array(list(calendar['dt'].map(func('next'))))
-    calendar['next_delay'] = next_h[:, 0]
-    calendar['next_holiday'] = next_h[:, 1]
-    prev_h = np.array(list(calendar['dt'].map(func('previous'))))
-    calendar['prev_delay'] = prev_h[:, 0]
-    calendar['prev_holiday'] = prev_h[:, 1]
+    days = pd.to_datetime(calendar['dt']).values.astype('datetime64[D]')
+    valid = ~np.isnat(days)
+    years = pd.DatetimeIndex(days[valid]).year
+    if len(years) > 0:
+        years = range(years.min() - 1, years.max() + 2)
+    dates, names = holiday_dates(holidays, years)
+    # sentinel after every date, so lookups of valid dates stay in bounds
+    dates = np.append(dates, np.datetime64('9999-12-31'))
+
+    nxt = np.searchsorted(dates, days, side='left').clip(max=len(dates) - 1)
+    delay = (dates[nxt] - days).astype(np.int64)
+    found = valid & (delay <= 365)
+    calendar['next_delay'] = np.where(found, delay, 365)
+    calendar['next_holiday'] = np.where(found, names[nxt], None)
+
+    prev = np.searchsorted(dates, days, side='right') - 1
+    delay = (days - dates[prev]).astype(np.int64)
+    found = valid & (prev >= 0) & (delay <= 365)
+    calendar['prev_delay'] = np.where(found, delay, 365)
+    calendar['prev_holiday'] = np.where(found, names[prev], None)
     return calendar
 
+def parse_datetime(values, formats=(), cache=None, key=None):
+    """
+    parse an array of datetime strings with an explicit format.
+    formats are tried in order, a format matching a sample of values is
+    used for the whole array. pandas inference is the fallback.
+    a format is remembered in cache[key], and used first on the next
+    calls, only once the values settle it: no other format reads them
+    as different dates (a day above 12 tells %d/%m from %m/%d).
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return pd.to_datetime(values)
+    if cache is not None and key in cache:
+        try:
+            return pd.to_datetime(values, format=cache[key])
+        except (ValueError, TypeError):
+            pass
+    sample = pd.Series(values[:100]).dropna()
+    parsed, found = None, None
+    for fmt in formats:
+        try:
+            pd.to_datetime(sample, format=fmt)
+            res = pd.to_datetime(values, format=fmt)
+        except (ValueError, TypeError):
+            continue
+        if parsed is None:
+            parsed, found = res, fmt
+        elif not pd.Index(res).equals(pd.Index(parsed)):
+            # ambiguous values, the first format is not remembered
+            return parsed
+    if parsed is None:
+        return pd.to_datetime(values)
+    if cache is not None:
+        cache[key] = found
+    return parsed
+
+def datetime_parts(values, dates=None, names=None):
+    """
+    decompose a datetime64 array into its elementary components,
+    computed with integer arithmetic on the array.
+    if a date dimension is given year, month, day and day_of_week are
+    taken from it by date key instead.
+    if names is given only these components are computed.
+    components of NaT entries are NaN.
+    """
+    if names is None:
+        names = ['dt', 'year', 'month', 'day', 'hour', 'minute', 'second', 'time_ratio', 'day_of_week']
+    values = np.asarray(values, dtype='datetime64[s]')
+    days = values.astype('datetime64[D]')
+    parts = {}
+    if 'dt' in names:
+        parts['dt'] = days
+    if {'hour', 'minute', 'second', 'time_ratio'} & set(names):
+        seconds = (values - days).astype(np.int64)
+        times = {
+            'hour': seconds // 3600,
+            'minute': seconds // 60 % 60,
+            'second': seconds % 60}
+        parts.update((name, part) for name, part in times.items() if name in names)
+        if 'time_ratio' in names:
+            parts['time_ratio'] = (times['hour'] + times['minute']/60 + times['second']/3600)/24
+    date_names = [name for name in ['year', 'month', 'day', 'day_of_week'] if name in names]
+    if date_names and dates is not None:
+        parts.update(dates.take(days.astype(np.int64), date_names))
+    elif date_names:
+        months = values.astype('datetime64[M]')
+        years = values.astype('datetime64[Y]')
+        if 'year' in names:
+            parts['year'] = years.astype(np.int64) + 1970
+        if 'month' in names:
+            parts['month'] = (months - years).astype(np.int64) + 1
+        if 'day' in names:
+            parts['day'] = (days - months).astype(np.int64) + 1
+        if 'day_of_week' in names:
+            # 1970-01-01 is a thursday, isoweekday 4
+            parts['day_of_week'] = (days.astype(np.int64) + 3) % 7 + 1
+
+    nat = np.isnat(values)
+    if nat.any():
+        for name, part in parts.items():
+            if name != 'dt':
+                parts[name] = np.where(nat, np.nan, part)
+    return parts
+
 def search_config(**kwargs):
     """wrapper for html search criteria"""
     config = {}
@@ -71,8 +265,8 @@ def html_doc(url, search_cfg):
     """
     extract all html elements from web page satisfying a search criteria
     """
-    data = requests.get(url).text
-    docs = BeautifulSoup(data, "lxml").find_all(**search_cfg)
+    data = get_text(url)
+    docs = bs4.BeautifulSoup(data, "lxml").find_all(**search_cfg)
     return docs
 
 def href_from_doc_list(doc_list, tag='href'):
@@ -87,12 +281,13 @@ def text_from_doc_list(doc_list):
     """
     return [doc.text for doc in doc_list]
 
-def docs_from_url(url, search_cfg):
+def docs_from_url(url, search_cfg, cache=None):
     """
     extract html elements from url satisfying  a config dict.
+    the page is read through cache (a ListingCache) if given.
     """
-    data = requests.get(url).text
-    docs = BeautifulSoup(data, "lxml").find_all(**search_cfg)
+    data = fetch_page(url, cache)
+    docs = bs4.BeautifulSoup(data, "lxml").find_all(**search_cfg)
     return docs
 
 def href_from_url(url, search_cfg):
@@ -100,8 +295,8 @@ def href_from_url(url, search_cfg):
     extract hyperlinks from web page.
     requires a search_cfg to determine which links to download.
     """
-    data = requests.get(url).text
-    docs = BeautifulSoup(data, "lxml").find_all(**search_cfg)
+    data = get_text(url)
+    docs = bs4.BeautifulSoup(data, "lxml").find_all(**search_cfg)
     return [doc.get('href') for doc in docs]
 
 def years_query(query):
@@ -142,15 +337,19 @@ def is_in_path(file_path, find_str):
     find_str = find_str.lower()
     return file_path.split('/')[-1].find(find_str) >= 0
 
+def format_column_name(txt):
+    """
+    standardize a column name.
+    """
+    txt = txt.lower()
+    txt = txt.replace(' ', '_')
+    txt = txt.replace('-', '_')
+    txt = txt.replace('.', '_')
+    return txt
+
 def format_column_names(df):
     """
     standardize  pandas df columns names.
     """
-    def reformat(txt):
-        txt = txt.lower()
-        txt = txt.replace(' ', '_')
-        txt = txt.replace('-', '_')
-        txt = txt.replace('.', '_')
-        return txt
-    columns = {col: reformat(col) for col in df.columns}
+    columns = {col: format_column_name(col) for col in df.columns}
     df.rename(columns, axis=1, inplace=True)
@@ -0,0 +1,203 @@
+"""
+Writers of processed trip data.
+Classes: CsvWriter, ParquetWriter
+"""
+import os
+import logging
+
+from biketrips.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 128 * 1024
+PARTITION_COLUMNS = ['start_year', 'start_month']
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+STATION_COLUMNS = ['start_station_code', 'end_station_code']
+STATION_KEY_COLUMNS = ['start_station_key', 'end_station_key']
+
+
+def station_codes(values):
+    """
+    station codes as strings, integer codes read back as floats
+    (6070.0) give the same string as the integers (6070).
+    """
+    return pd.Series(values, dtype=object).astype(str).str.replace(r'\.0$', '', regex=True)
+
+def file_stats(trip_df):
+    """
+    start_dt range (YYYY-MM-DD) and station codes of the rows of a file,
+    recorded in the manifest for read back pruning. star schema files
+    give their station keys instead of codes.
+    """
+    stats = {'min_start_dt': None, 'max_start_dt': None, 'stations': None}
+    dates = None
+    if 'start_dt' in trip_df:
+        dates = pd.to_datetime(trip_df['start_dt'], errors='coerce').dropna()
+    elif 'start_date_key' in trip_df:
+        dates = pd.to_datetime(trip_df['start_date_key'].dropna().astype('int64'), unit='D')
+    if dates is not None and len(dates):
+        stats['min_start_dt'] = dates.min().strftime('%Y-%m-%d')
+        stats['max_start_dt'] = dates.max().strftime('%Y-%m-%d')
+    columns = [column for column in STATION_COLUMNS if column in trip_df]
+    if columns:
+        codes = set()
+        for column in columns:
+            codes.update(station_codes(trip_df[column].dropna().unique()))
+        stats['stations'] = sorted(codes)
+    columns = [column for column in STATION_KEY_COLUMNS if column in trip_df]
+    if columns:
+        keys = set()
+        for column in columns:
+            keys.update(int(key) for key in trip_df[column].dropna().unique())
+        stats['station_keys'] = sorted(keys)
+    return stats
+
+
+def make_writer(data_dir, bike_sys, args):
+    """
+    return the writer matching the output_format of args.
+    """
+    output_format = args.get('output_format', 'csv')
+    if output_format == 'csv':
+        return CsvWriter()
+    if output_format == 'parquet':
+        return ParquetWriter(
+            root=os.path.join(data_dir, 'parquet'),
+            bike_sys=bike_sys,
+            row_group_size=args.get('row_group_size', ROW_GROUP_SIZE))
+    raise Exception(f'Wrong value for output_format. {output_format} not found in [csv, parquet]')
+
+
+class CsvWriter:
+    """
+    write each chunk to a csv file in the folder of its source.
+    """
+    required_columns = []
+
+    def write(self, trip_df, save_dir, save_name):
+        """
+        write trip_df, return the written files and their stats.
+        """
+        path = os.path.join(save_dir, save_name)
+        trip_df.to_csv(path, index=False)
+        return {path: file_stats(trip_df)}
+
+
+class ParquetWriter:
+    """
+    write chunks as compressed parquet files partitioned by
+    operator/start_year/start_month (hive style) under root.
+    all the chunks of a source file share the schema of the first one
+    written, saved in root/_schemas, so that types don't drift between
+    chunks. partition columns are stored in the paths only.
+    """
+    required_columns = PARTITION_COLUMNS
+
+    def __init__(self, root, bike_sys, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+        try:
+            import pyarrow
+        except ImportError as err:
+            raise ImportError('output_format parquet requires pyarrow') from err
+        self.root = root
+        self.bike_sys = bike_sys
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.schemas = {}
+
+    def schema(self, key, table):
+        """
+        return the reference schema of key.
+        the schema of table becomes the reference if there is none yet.
+        """
+        import pyarrow as pa
+
+        if key in self.schemas:
+            return self.schemas[key]
+        path = os.path.join(self.root, '_schemas', key)
+        if not os.path.exists(path):
+            # columns without any value in the first chunk are strings,
+            # categoricals are stored as their values
+            fields = []
+            for field in table.schema:
+                if pa.types.is_null(field.type):
+                    field = field.with_type(pa.string())
+                elif pa.types.is_dictionary(field.type):
+                    field = field.with_type(field.type.value_type)
+                fields.append(field)
+            schema = pa.schema(fields)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(schema.serialize())
+            try:
+                # the first process to commit its schema wins
+                os.link(tmp_path, path)
+            except FileExistsError:
+                pass
+            os.remove(tmp_path)
+        with open(path, 'rb') as file:
+            schema = pa.ipc.read_schema(pa.py_buffer(file.read()))
+        self.schemas[key] = schema
+        return schema
+
+    def conform(self, table, schema):
+        """
+        cast table to schema. missing columns are filled with nulls,
+        columns unknown to schema are dropped.
+        """
+        import pyarrow as pa
+
+        columns = []
+        for field in schema:
+            if field.name in table.column_names:
+                columns.append(table[field.name].cast(field.type))
+            else:
+                columns.append(pa.nulls(len(table), field.type))
+        dropped = set(table.column_names) - set(schema.names)
+        if dropped:
+            logger.warning(f'columns not in schema dropped: {sorted(dropped)}')
+        return pa.Table.from_arrays(columns, schema=schema)
+
+    def partition_dir(self, year, month):
+        values = []
+        for value in [year, month]:
+            values.append(DEFAULT_PARTITION if value != value else int(value))
+        return os.path.join(
+            self.root,
+            f'operator={self.bike_sys}',
+            f'start_year={values[0]}',
+            f'start_month={values[1]}')
+
+    def write(self, trip_df, save_dir, save_name):
+        """
+        write trip_df, one file per partition.
+        return the written files and their stats.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        source = os.path.basename(save_dir)
+        stem = save_name.split('.')[0]
+        file_key = '_'.join([source] + stem.split('_')[:2])
+        table = pa.Table.from_pandas(trip_df, preserve_index=False)
+        table = self.conform(table, self.schema(file_key, table))
+
+        groups = trip_df.groupby(PARTITION_COLUMNS, sort=True, dropna=False).indices
+        paths = {}
+        for (year, month), rows in groups.items():
+            part = table.take(pa.array(rows)).drop(PARTITION_COLUMNS)
+            part_dir = self.partition_dir(year, month)
+            os.makedirs(part_dir, exist_ok=True)
+            path = os.path.join(part_dir, f'{source}_{stem}.parquet')
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            pq.write_table(
+                part,
+                tmp_path,
+                compression=self.compression,
+                row_group_size=self.row_group_size)
+            os.replace(tmp_path, path)
+            paths[path] = file_stats(trip_df.iloc[rows])
+        return paths
@@ -2,6 +2,11 @@
 main module. runs the job.
 
 main.py --config=config.json --bike-sys=bixi
+main.py --config=config.json --bike-sys=bixi,citi
+main.py --config=config.json --bike-sys=all
+main.py --config=config.json --bike-sys=all --dry-run
+main.py --config=config.json --bike-sys=all --shard=0/4
+main.py --list
 
 see BIKESYS.md for the list of available tags with the corresponding bike system tags. 
 
@@ -10,28 +15,55 @@ import os
 import json
 import logging
 import argparse
+from biketrips.bikesystem import bike_sys_list
+from biketrips.bikesystem import operators
+from biketrips.bikesystem import run_many
 from biketrips.bikesystem import selector
+from biketrips.utils import LOG_FMT
+from biketrips.utils import LOG_DATEFMT
 
 if __name__ == "__main__":
-    log_fmt = '%(asctime)s %(levelname)s %(name)s %(funcName)s : %(message)s'
-    logging.basicConfig(level=logging.INFO, format=log_fmt, datefmt='%y/%m/%d %H:%M:%S')
+    logging.basicConfig(level=logging.INFO, format=LOG_FMT, datefmt=LOG_DATEFMT)
     logger = logging.getLogger(__name__)
 
     parser = argparse.ArgumentParser(description='bike-trips')
     parser.add_argument('--config', type=str, help='path string to config file')
-    parser.add_argument('--bike-sys', type=str, help='bike system tag')
+    parser.add_argument('--bike-sys', type=str, help='bike system tag, comma separated tags or all')
+    parser.add_argument('--list', action='store_true', help='list the available bike systems and exit')
+    parser.add_argument('--dry-run', action='store_true', help='list the urls a run would process and exit')
+    parser.add_argument('--shard', type=str, default=None, help='i/N: process the i-th of N hash partitions of the urls')
     parsed_args = parser.parse_args().__dict__
 
+    if parsed_args['list']:
+        for tag, operator in operators().items():
+            if not isinstance(operator, str):
+                operator = f'{operator.__module__}:{operator.__name__}'
+            print(f'{tag}: {operator}')
+        raise SystemExit
+
     with open(parsed_args['config'], 'r') as f:
         args = json.load(f)
 
-    args['bike_sys'] = parsed_args['bike_sys']
+    tags = bike_sys_list(parsed_args['bike_sys'])
+    if parsed_args['shard'] is not None:
+        args['shard'] = parsed_args['shard']
     if 'data_dir' not in args:
         args['data_dir'] = '.'
-    args['data_dir'] = os.path.join(args['data_dir'], args['bike_sys'])
 
     #for key in args:
     #    logger.info(f'args --> {key}: {args[key]} - type: {type(args[key])}')
 
-    logger.info('data will be downloaded to {}'.format(os.path.abspath(args['data_dir'])))
-    selector(args).run()
+    if parsed_args['dry_run']:
+        # the url plan only needs the listings, trip data is never loaded
+        for tag in tags:
+            trip = selector(dict(args, bike_sys=tag, data_dir=os.path.join(args['data_dir'], tag)))
+            for url, status in trip.plan(trip.find_urls()):
+                print(f'{tag} {status}: {url}')
+    elif len(tags) > 1:
+        logger.info('data will be downloaded to {}'.format(os.path.abspath(args['data_dir'])))
+        run_many(args, tags)
+    else:
+        args['bike_sys'] = tags[0]
+        args['data_dir'] = os.path.join(args['data_dir'], args['bike_sys'])
+        logger.info('data will be downloaded to {}'.format(os.path.abspath(args['data_dir'])))
+        selector(args).run()
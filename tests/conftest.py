@@ -0,0 +1,90 @@
+"""
+Fixtures of the tests: a local http server standing in for the sources.
+"""
+import re
+import threading
+import http.server
+import socketserver
+
+import pytest
+
+
+class SourceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    serve the files of the server with ETag, Range and If-Range.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def respond(self, body):
+        server = self.server
+        name = self.path.lstrip('/')
+        server.requests.append((self.command, name, dict(self.headers)))
+        if server.failures.get(name):
+            self.send_response(server.failures[name].pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if name not in server.files:
+            self.send_error(404)
+            return
+        data, etag = server.files[name]
+        start = 0
+        byte_range = self.headers.get('Range')
+        # a changed source is sent whole, unless If-Range is ignored
+        if byte_range and (not server.if_range or self.headers.get('If-Range') in [None, etag]):
+            start = int(re.match(r'bytes=(\d+)-', byte_range).group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if body:
+            # a cut transfer ends before Content-Length, once
+            end = server.cuts.pop(name, len(data))
+            self.wfile.write(data[start:max(start, end)])
+
+
+class SourceServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SourceHandler)
+        # name: (content, etag)
+        self.files = {}
+        # name: statuses answered before the file
+        self.failures = {}
+        # name: byte at which the next transfer is cut
+        self.cuts = {}
+        self.if_range = True
+        self.requests = []
+
+    def publish(self, name, data, etag):
+        self.files[name] = (data, f'"{etag}"')
+
+    def url(self, name):
+        return 'http://{}:{}/{}'.format(*self.server_address, name)
+
+
+@pytest.fixture
+def server():
+    source_server = SourceServer()
+    thread = threading.Thread(target=source_server.serve_forever, daemon=True)
+    thread.start()
+    yield source_server
+    source_server.shutdown()
+    source_server.server_close()
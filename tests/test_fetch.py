@@ -0,0 +1,131 @@
+import os
+import time
+
+import pytest
+import requests
+
+from biketrips.fetch import BLOCK_SIZE
+from biketrips.fetch import Prefetcher
+from biketrips.fetch import Throttle
+from biketrips.fetch import download_file
+from biketrips.fetch import fetch_file
+from biketrips.fetch import partial_paths
+
+DATA = bytes(range(256)) * 10000
+NEW_DATA = DATA[::-1] + b'republished'
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+def interrupted(file_path, data, validator):
+    """
+    leave the partial download of the first half of data.
+    """
+    part_path, validator_path = partial_paths(file_path)
+    with open(part_path, 'wb') as file:
+        file.write(data[:len(data) // 2])
+    if validator is not None:
+        with open(validator_path, 'w') as file:
+            file.write(validator)
+
+def ranges(server):
+    return [headers.get('Range') for command, _, headers in server.requests if command == 'GET']
+
+
+def test_download(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    file_path = str(tmp_path / 'a.zip')
+    assert download_file(server.url('a.zip'), file_path) == file_path
+    assert read(file_path) == DATA
+    assert not any(os.path.exists(path) for path in partial_paths(file_path))
+
+def test_resume(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    file_path = str(tmp_path / 'a.zip')
+    interrupted(file_path, DATA, '"v1"')
+    download_file(server.url('a.zip'), file_path)
+    assert read(file_path) == DATA
+    assert ranges(server) == [f'bytes={len(DATA) // 2}-']
+    assert server.requests[0][2]['If-Range'] == '"v1"'
+
+def test_retry_resumes_cut_transfer(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    # the blocks received before the cut are kept
+    server.cuts['a.zip'] = BLOCK_SIZE + 1000
+    file_path = str(tmp_path / 'a.zip')
+    fetch_file(server.url('a.zip'), file_path, retries=1, backoff=0)
+    assert read(file_path) == DATA
+    assert ranges(server) == [None, f'bytes={BLOCK_SIZE}-']
+
+@pytest.mark.parametrize('if_range', [True, False])
+def test_resume_after_source_changed(server, tmp_path, if_range):
+    server.publish('a.zip', NEW_DATA, 'v2')
+    server.if_range = if_range
+    file_path = str(tmp_path / 'a.zip')
+    interrupted(file_path, DATA, '"v1"')
+    download_file(server.url('a.zip'), file_path)
+    assert read(file_path) == NEW_DATA
+
+def test_resume_without_validator(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    file_path = str(tmp_path / 'a.zip')
+    interrupted(file_path, NEW_DATA, None)
+    download_file(server.url('a.zip'), file_path)
+    assert read(file_path) == DATA
+    assert ranges(server) == [None]
+
+def test_416_complete_partial_file(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    file_path = str(tmp_path / 'a.zip')
+    interrupted(file_path, DATA + DATA, '"v1"')
+    download_file(server.url('a.zip'), file_path)
+    assert read(file_path) == DATA
+    assert ranges(server) == [f'bytes={len(DATA)}-']
+
+def test_416_partial_file_larger_than_source(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    file_path = str(tmp_path / 'a.zip')
+    interrupted(file_path, DATA * 3, '"v1"')
+    download_file(server.url('a.zip'), file_path)
+    assert read(file_path) == DATA
+    assert ranges(server) == [f'bytes={len(DATA) * 3 // 2}-', None]
+
+def test_retryable_error(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    server.failures['a.zip'] = [503, 502]
+    file_path = str(tmp_path / 'a.zip')
+    fetch_file(server.url('a.zip'), file_path, retries=2, backoff=0)
+    assert read(file_path) == DATA
+
+def test_retries_exhausted(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    server.failures['a.zip'] = [503, 503]
+    with pytest.raises(requests.HTTPError):
+        fetch_file(server.url('a.zip'), str(tmp_path / 'a.zip'), retries=1, backoff=0)
+    assert len(server.requests) == 2
+
+def test_fatal_error(server, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        fetch_file(server.url('missing.zip'), str(tmp_path / 'a.zip'), retries=3, backoff=0)
+    assert len(server.requests) == 1
+
+def test_throttle():
+    throttle = Throttle(1e6)
+    started = time.monotonic()
+    for _ in range(15):
+        throttle.consume(1e5)
+    # a second of transfer ahead is allowed
+    assert time.monotonic() - started >= 0.45
+
+def test_prefetcher(server, tmp_path):
+    server.publish('a.zip', DATA, 'v1')
+    server.publish('b.zip', NEW_DATA, 'v2')
+    with Prefetcher(max_per_host=1, retries=0, backoff=0) as prefetcher:
+        for name in ['a.zip', 'b.zip', 'missing.zip']:
+            prefetcher.submit(server.url(name), str(tmp_path / name))
+        assert prefetcher.wait(server.url('a.zip')) == str(tmp_path / 'a.zip')
+        assert prefetcher.wait(server.url('b.zip')) == str(tmp_path / 'b.zip')
+        assert prefetcher.wait(server.url('missing.zip')) is None
+    assert read(tmp_path / 'b.zip') == NEW_DATA
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from biketrips.lease import Leases
+from biketrips.lease import in_shard
+from biketrips.lease import parse_shard
+
+
+@pytest.fixture
+def leases(tmp_path):
+    """
+    make Leases of tmp_path, as held by distinct processes.
+    """
+    made = []
+
+    def make(ttl=60):
+        made.append(Leases(str(tmp_path), ttl))
+        return made[-1]
+
+    yield make
+    for lease in made:
+        lease.close()
+
+def age(leases, name, seconds):
+    path = leases.lease_path(name)
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_exclusive(leases):
+    first, second = leases(), leases()
+    assert first.acquire('a.zip')
+    assert not second.acquire('a.zip')
+    assert second.acquire('b.zip')
+    first.release('a.zip')
+    assert second.acquire('a.zip')
+
+def test_release_keeps_lease_of_other_holder(leases):
+    first, second = leases(ttl=10), leases(ttl=10)
+    assert first.acquire('a.zip')
+    age(first, 'a.zip', 60)
+    assert second.acquire('a.zip')
+    first.release('a.zip')
+    assert second.holds('a.zip')
+
+def test_expired_lease_taken_over(leases):
+    first, second = leases(ttl=10), leases(ttl=10)
+    assert first.acquire('a.zip')
+    assert first.holds('a.zip')
+    assert not second.acquire('a.zip')
+    age(first, 'a.zip', 60)
+    assert second.acquire('a.zip')
+    assert second.holds('a.zip')
+    assert not first.holds('a.zip')
+    assert 'a.zip' in first.lost
+
+def test_lease_of_dead_process_taken_over(leases, tmp_path):
+    process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+    owner = {'host': socket.gethostname(), 'pid': int(process.stdout), 'token': 'dead'}
+    with open(tmp_path / 'a.zip.lease', 'w') as file:
+        json.dump(owner, file)
+    assert leases().acquire('a.zip')
+
+def test_renewed_lease_not_taken_over(leases):
+    first, second = leases(ttl=0.4), leases(ttl=0.4)
+    assert first.acquire('a.zip')
+    time.sleep(0.8)
+    assert not second.acquire('a.zip')
+    assert first.holds('a.zip')
+
+def test_acquire_waits_for_release(leases):
+    first, second = leases(), leases()
+    assert first.acquire('finalize')
+    assert not second.acquire('finalize', wait=0)
+    first.close()
+    assert second.acquire('finalize', wait=1)
+
+def test_copy_checks_leases(leases):
+    import pickle
+
+    first, second = leases(ttl=10), leases(ttl=10)
+    assert first.acquire('a.zip')
+    copy = pickle.loads(pickle.dumps(first))
+    assert copy.holds('a.zip')
+    age(first, 'a.zip', 60)
+    assert second.acquire('a.zip')
+    assert not copy.holds('a.zip')
+
+def test_shards():
+    assert parse_shard('1/3') == (1, 3)
+    assert parse_shard([0, 2]) == (0, 2)
+    with pytest.raises(Exception):
+        parse_shard('3/3')
+    urls = [f'https://host/{year}-{month:02d}.zip' for year in range(2014, 2022) for month in range(1, 13)]
+    shards = [[url for url in urls if in_shard(url, (index, 3))] for index in range(3)]
+    assert sorted(sum(shards, [])) == sorted(urls)
+    assert all(shards)
@@ -0,0 +1,29 @@
+import os
+import zlib
+from zipfile import BadZipFile
+
+import pytest
+
+from benchmarks.synthetic import make_archive
+from biketrips.operators.bixi import Bixi
+
+
+def test_corrupt_archive_downloaded_again(server, tmp_path):
+    path = make_archive('bixi', 1000, str(tmp_path / 'source'))
+    name = os.path.basename(path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    corrupt = data[:len(data) // 2] + bytes(100) + data[len(data) // 2 + 100:]
+    server.publish(name, corrupt, 'v1')
+    data_dir = tmp_path / 'data'
+    trip = Bixi({'data_dir': str(data_dir)})
+
+    with pytest.raises((BadZipFile, zlib.error)):
+        trip.download(server.url(name))
+    # neither the archive nor the unpacked files are left
+    assert os.listdir(data_dir) == []
+
+    server.publish(name, data, 'v2')
+    save_dir, files = trip.download(server.url(name))
+    assert sorted(os.path.basename(file) for file in files) == ['OD_2021-07.csv', 'Stations_2021.csv']
+    assert trip.manifest.get(server.url(name))['status'] == 'processing'
@@ -0,0 +1,68 @@
+import io
+import os
+import glob
+from zipfile import ZipFile
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_archive
+from biketrips import denormalize
+from biketrips.bikesystem import operator_class
+
+# citi and cabi trips since 2021
+CITI_2021_COLUMNS = {
+    'starttime': 'started_at',
+    'stoptime': 'ended_at',
+    'start station id': 'start_station_id',
+    'start station name': 'start_station_name',
+    'start station latitude': 'start_lat',
+    'start station longitude': 'start_lng',
+    'end station id': 'end_station_id',
+    'end station name': 'end_station_name',
+    'end station latitude': 'end_lat',
+    'end station longitude': 'end_lng',
+    }
+
+
+def citi_2021_archive(out_dir):
+    path = make_archive('citi', 2000, out_dir)
+    with ZipFile(path, 'r') as zip_file:
+        name = zip_file.namelist()[0]
+        trip_df = pd.read_csv(zip_file.open(name))
+    trip_df = trip_df.rename(CITI_2021_COLUMNS, axis=1)[list(CITI_2021_COLUMNS.values())]
+    with ZipFile(path, 'w') as zip_file:
+        zip_file.writestr(name, trip_df.to_csv(index=False))
+    return path
+
+def run(operator, url, data_dir, **args):
+    trip = operator_class(operator)({'data_dir': data_dir, 'chunk_size': 500, **args})
+    trip.run(url_list=[url])
+
+def csv_round_trip(trip_df):
+    return pd.read_csv(io.StringIO(trip_df.to_csv(index=False)))
+
+
+@pytest.mark.parametrize('operator', ['bixi', 'bsto', 'cabi', 'citi', 'citi_2021'])
+def test_denormalize_gives_flat_trips(server, tmp_path, operator):
+    if operator == 'citi_2021':
+        operator, path = 'citi', citi_2021_archive(str(tmp_path / 'source'))
+    else:
+        path = make_archive(operator, 2000, str(tmp_path / 'source'))
+    name = os.path.basename(path)
+    with open(path, 'rb') as file:
+        server.publish(name, file.read(), 'v1')
+    flat_dir, star_dir = str(tmp_path / 'flat'), str(tmp_path / 'star')
+    run(operator, server.url(name), flat_dir)
+    run(operator, server.url(name), star_dir, star_schema=True)
+
+    source = name.split('.')[0]
+    flat_paths = sorted(glob.glob(os.path.join(flat_dir, source, 'trip_*.csv')))
+    assert flat_paths
+    for flat_path in flat_paths:
+        flat = pd.read_csv(flat_path)
+        star = pd.read_csv(flat_path.replace(flat_dir, star_dir))
+        assert 'start_station_key' in star and 'start_station_code' not in star
+        trips = csv_round_trip(denormalize(star, star_dir))
+        assert list(trips.columns) == list(flat.columns)
+        pd.testing.assert_frame_equal(trips, flat, check_dtype=False)
@@ -0,0 +1,45 @@
+import os
+from zipfile import ZipFile
+
+import pandas as pd
+import pytest
+
+from biketrips.arrow_csv import has_pyarrow
+from biketrips.utils import read_csv
+from biketrips.utils import zip_members
+
+ENGINES = ['pandas'] + (['pyarrow'] if has_pyarrow() else [])
+
+
+def open_files():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / 'trips.zip')
+    trip_df = pd.DataFrame({'code': range(1000), 'name': [f'station {i}' for i in range(1000)]})
+    with ZipFile(path, 'w') as zip_file:
+        for name in ['a.csv', 'b.csv', '__MACOSX/._a.csv']:
+            zip_file.writestr(name, trip_df.to_csv(index=False))
+    return path, trip_df
+
+
+def test_zip_members(archive):
+    path, _ = archive
+    assert [member.member for member in zip_members(path)] == ['a.csv', 'b.csv']
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/fd'), reason='counts the open files of /proc')
+@pytest.mark.parametrize('engine', ENGINES)
+def test_zip_member_closed_once_read(archive, engine):
+    path, trip_df = archive
+    members = zip_members(path)
+    before = open_files()
+    for member in members:
+        pd.testing.assert_frame_equal(read_csv(member, engine=engine), trip_df, check_dtype=False)
+    assert open_files() == before
+    for member in members:
+        with read_csv(member, engine=engine, chunksize=300) as reader:
+            chunks = list(reader)
+        assert sum(len(chunk) for chunk in chunks) == len(trip_df)
+    assert open_files() == before